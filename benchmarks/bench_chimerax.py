@@ -0,0 +1,136 @@
+#Benchmarks of the commands and helpers that need ChimeraX. Run headless with e.g.
+#   chimerax --nogui --exit --script "benchmarks/bench_chimerax.py --sizes 128 256 --output bench_cx.json"
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+import os
+import sys
+import argparse
+import numpy as np
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, bench_dir)
+import bench_common
+from bench_common import MAPS, measure, Report
+
+
+def open_command_scripts(session, names):
+    from chimerax.core.commands import run
+    for name in names:
+        run(session, 'open "%s"' % os.path.join(bench_common.repo_dir, name), log=False)
+
+
+def new_volume(session, array, step=1.0, name='bench'):
+    from chimerax.map_data import ArrayGridData
+    from chimerax.map import volume_from_grid_data
+    grid = ArrayGridData(array, step=(step, step, step), name=name)
+    return volume_from_grid_data(grid, session, show_dialog=False)
+
+
+def new_structure(session, xyz, name='bench atoms'):
+    # One residue per atom is slow to build for millions of atoms, so put up to 1000 atoms in each residue.
+    from chimerax.atomic import AtomicStructure
+    s = AtomicStructure(session, name=name)
+    for start in range(0, len(xyz), 1000):
+        r = s.new_residue('UNK', 'A', start // 1000 + 1)
+        for i in range(start, min(start + 1000, len(xyz))):
+            a = s.new_atom('C%d' % (i - start), 'C')
+            a.coord = xyz[i]
+            r.add_atom(a)
+    session.models.add([s])
+    return s
+
+
+def bench_centroids(session, report, args):
+    import chimerax_centroids as centroids
+    for count in args.atoms:
+        name = 'define_centroid %d atoms' % count
+        if args.only and args.only not in name:
+            continue
+        xyz, masses = bench_common.atom_cloud(count)
+        s = new_structure(session, xyz)
+        report.add(name + ' uncached', measure(centroids.atoms_centroid, s.atoms, repeat=args.repeat), atoms=count)
+        report.add(name + ' mass weighted uncached', measure(centroids.atoms_centroid, s.atoms, mass_weighting=True,
+                                                             repeat=args.repeat), atoms=count)
+        centroids.define_centroid(session, s.atoms)
+        report.add(name + ' cached', measure(centroids.define_centroid, session, s.atoms, repeat=args.repeat), atoms=count)
+        session.models.close([s])
+
+
+def bench_soft_edge_mask_command(session, report, args):
+    from chimerax.core.commands.cli import command_function
+    soft_edge_mask = command_function('soft edge mask')
+    for size in args.sizes:
+        name = 'soft edge mask command blobs %d' % size
+        if args.only and args.only not in name:
+            continue
+        v = new_volume(session, MAPS['blobs'](size))
+        created = []
+        report.add(name, measure(lambda: created.append(soft_edge_mask(session, v, level=0.5, extend=3, width=12)),
+                                 repeat=args.repeat), size=size)
+        session.models.close(created + [v])
+
+
+class EraserSphere:
+    # Stands in for the map eraser sphere model (only its position and radius are used).
+    def __init__(self, center, radius):
+        from chimerax.geometry import Place
+        self.scene_position = Place(origin=center)
+        self.radius = radius
+
+
+def bench_map_eraser(session, report, args):
+    from chimerax.core.commands.cli import command_function
+    map_eraser_mask_create = command_function('map eraser mask create')
+    for size in args.sizes:
+        name = 'map eraser mask create %d' % size
+        if args.only and args.only not in name:
+            continue
+        v = new_volume(session, MAPS['sphere'](size))
+        sphere = EraserSphere(center=np.array([0.8 * size, 0.5 * size, 0.5 * size]), radius=0.15 * size)
+        before = set(session.models)
+
+        def run_pipeline():
+            map_eraser_mask_create(session, [v], sphere, save_masks=False)
+            session.models.close([m for m in session.models if m not in before and m.parent is session.models.scene_root_model])
+        report.add(name, measure(run_pipeline, repeat=args.repeat), size=size)
+        session.models.close([v])
+
+
+def check_workers(session, args):
+    # Worker processes must start from inside ChimeraX (see chimerax_parallel.python_executable) and give the same
+    # masks as this process, without falling back to running serially. Returns the number of failures.
+    import chimerax_soft_edge_mask as masks
+    from chimerax_parallel import TaskRunner, python_executable
+    if args.only and args.only not in 'worker processes':
+        return 0
+    messages = []
+    m = MAPS['blobs'](48)
+    tasks = [(masks.extend_and_soften_mask, (m, 0.5, extend, 6), {}) for extend in (0, 3)]
+    with TaskRunner(2, log=messages.append) as runner:
+        parallel = not runner.serial
+        results = runner.run(tasks) + runner.run([(os.getpid, (), {})])
+    same = all(np.array_equal(r, masks.extend_and_soften_mask(m, 0.5, extend, 6)) for r, extend in zip(results, (0, 3)))
+    ok = parallel and same and results[-1] != os.getpid()
+    print('%-55s %s (%s)' % ('worker processes (jobs 2)', 'ok' if ok else 'FAILED', ' '.join(messages) or python_executable()))
+    return 0 if ok else 1
+
+
+def main(session, argv):
+    parser = argparse.ArgumentParser(prog='bench_chimerax.py', description='Benchmark the ChimeraX commands (run with chimerax --nogui --script).')
+    bench_common.add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    open_command_scripts(session, ['chimerax_soft_edge_mask.py', 'chimerax_map_eraser_mask_create.py'])
+    report = Report('chimerax')
+    bench_centroids(session, report, args)
+    bench_soft_edge_mask_command(session, report, args)
+    bench_map_eraser(session, report, args)
+    failures = check_workers(session, args)
+    return bench_common.finish(report, args) or int(failures > 0)
+
+
+if 'session' in globals():
+    status = main(session, sys.argv[1:])
+    if status:
+        session.logger.warning('Benchmark regressions found')
+else:
+    print('Run this inside ChimeraX: chimerax --nogui --exit --script "%s [options]"' % os.path.abspath(__file__))
@@ -0,0 +1,157 @@
+#Shared pieces of the benchmark scripts: synthetic data, timing and the JSON report/baseline comparison.
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import tracemalloc
+import numpy as np
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if repo_dir not in sys.path:
+    sys.path.insert(0, repo_dir)
+
+
+# Synthetic data
+
+def sphere_map(size, radius_fraction=0.3):
+    # Solid sphere (value 1) in a cubic box, off centre so the bounding box crop is exercised.
+    c = (size - 1) / 2.0
+    z, y, x = np.ogrid[:size, :size, :size]
+    r2 = (z - c * 0.9) ** 2 + (y - c) ** 2 + (x - c * 1.1) ** 2
+    return (r2 <= (radius_fraction * size) ** 2).astype(np.float32)
+
+
+def shell_map(size, radius_fraction=0.4, thickness_fraction=0.05):
+    # Hollow spherical shell (an icosahedral-virus-like mask that fills most of the box).
+    c = (size - 1) / 2.0
+    z, y, x = np.ogrid[:size, :size, :size]
+    r = np.sqrt((z - c) ** 2 + (y - c) ** 2 + (x - c) ** 2)
+    return (np.abs(r - radius_fraction * size) <= thickness_fraction * size).astype(np.float32)
+
+
+def noisy_blobs_map(size, count=12, seed=0):
+    # Sum of random Gaussian blobs plus noise, scaled to roughly 0-1 like an auto-generated mask.
+    rng = np.random.default_rng(seed)
+    z, y, x = np.ogrid[:size, :size, :size]
+    m = np.zeros((size, size, size), dtype=np.float32)
+    for _ in range(count):
+        cz, cy, cx = rng.uniform(0.3, 0.7, 3) * size
+        sd = rng.uniform(0.03, 0.08) * size
+        m += np.exp(-((z - cz) ** 2 + (y - cy) ** 2 + (x - cx) ** 2) / (2 * sd * sd)).astype(np.float32)
+    m += rng.normal(0, 0.05, m.shape).astype(np.float32)
+    return m / m.max()
+
+
+MAPS = {'sphere': sphere_map, 'shell': shell_map, 'blobs': noisy_blobs_map}
+
+
+def atom_cloud(count, radius=60.0, seed=0):
+    # Random atom coordinates (Angstrom) filling a sphere, with carbon-to-sulfur like masses.
+    rng = np.random.default_rng(seed)
+    xyz = rng.normal(size=(count, 3))
+    xyz *= (radius * rng.uniform(0, 1, count) ** (1 / 3.0) / np.linalg.norm(xyz, axis=1))[:, None]
+    masses = rng.choice([12.011, 14.007, 15.999, 32.06], size=count, p=[0.62, 0.17, 0.19, 0.02])
+    return xyz, masses
+
+
+def planar_ring(count, radius=40.0, noise=0.2, seed=0):
+    # count points on a circle (C<count> symmetry) with a little out of plane noise.
+    rng = np.random.default_rng(seed)
+    angles = 2 * np.pi * np.arange(count) / count
+    points = np.stack([radius * np.cos(angles), radius * np.sin(angles), rng.normal(0, noise, count)], axis=1)
+    return points
+
+
+# Timing
+
+def measure(func, *args, repeat=3, **kwargs):
+    # Best wall time of repeat runs and the peak memory traced by tracemalloc (numpy arrays are traced).
+    times = []
+    peak = 0
+    for _ in range(repeat):
+        gc.collect()
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        func(*args, **kwargs)
+        times.append(time.perf_counter() - t0)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+    return {'wall_s': min(times), 'peak_mb': peak / 2**20, 'repeat': repeat}
+
+
+class Report:
+    def __init__(self, suite):
+        self.suite = suite
+        self.results = {}
+
+    def add(self, name, result, **params):
+        result = dict(result, params=params)
+        self.results[name] = result
+        print('%-55s %9.4f s %9.1f MB' % (name, result['wall_s'], result['peak_mb']))
+        sys.stdout.flush()
+
+    def as_dict(self):
+        versions = {'python': platform.python_version(), 'numpy': np.__version__}
+        try:
+            import scipy
+            versions['scipy'] = scipy.__version__
+        except ImportError:
+            pass
+        try:
+            from chimerax.core import version as chimerax_version
+            versions['chimerax'] = chimerax_version
+        except ImportError:
+            pass
+        return {'suite': self.suite, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'machine': platform.platform(),
+                'cpus': os.cpu_count(), 'versions': versions, 'results': self.results}
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1, sort_keys=True)
+        print('Results written to %s' % path)
+
+
+def compare(results, baseline_path, tolerance=1.2):
+    # Print current/baseline ratios. Returns the names of benchmarks slower (or bigger) than tolerance x baseline.
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+    regressions = []
+    print('\n%-55s %10s %10s' % ('Compared to %s' % os.path.basename(baseline_path), 'time', 'memory'))
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            print('%-55s %10s' % (name, 'new'))
+            continue
+        t_ratio = result['wall_s'] / max(base['wall_s'], 1e-9)
+        m_ratio = result['peak_mb'] / max(base['peak_mb'], 1e-9) if base['peak_mb'] > 1 else 1.0
+        flag = ''
+        if t_ratio > tolerance or m_ratio > tolerance:
+            flag = '  <-- regression'
+            regressions.append(name)
+        print('%-55s %9.2fx %9.2fx%s' % (name, t_ratio, m_ratio, flag))
+    return regressions
+
+
+def add_common_arguments(parser):
+    parser.add_argument('--sizes', type=int, nargs='+', default=[128, 256], help='map box sizes (default 128 256; try 512 768)')
+    parser.add_argument('--atoms', type=int, nargs='+', default=[10000, 1000000], help='atom cloud sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, best time kept (default 3)')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--baseline', help='compare against a stored results JSON')
+    parser.add_argument('--tolerance', type=float, default=1.2, help='ratio to baseline counted as a regression (default 1.2)')
+    parser.add_argument('--only', help='only run benchmarks whose name contains this text')
+
+
+def finish(report, args):
+    if args.output:
+        report.write(args.output)
+    if args.baseline:
+        regressions = compare(report.results, args.baseline, args.tolerance)
+        if regressions:
+            print('%d regression(s)' % len(regressions))
+            return 1
+    return 0
@@ -0,0 +1,134 @@
+#Benchmarks of the numpy kernels. Runs with a plain python (numpy + scipy), no ChimeraX needed. No baseline is
+#stored in the repository (timings depend on the machine and thread count, which are recorded in each results
+#file), so first save one from a known good setup, then compare later runs on the same machine against it:
+#   python benchmarks/bench_kernels.py --sizes 128 256 512 --output baseline_kernels.json
+#   python benchmarks/bench_kernels.py --sizes 128 256 512 --output bench.json --baseline baseline_kernels.json
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+import os
+import sys
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import bench_common
+from bench_common import MAPS, measure, Report
+
+
+def bench_masks(report, args):
+    import chimerax_soft_edge_mask as masks
+    masks.extend_and_soften_mask(MAPS['blobs'](16), 0.5, 3, 12) # warm up (first scipy calls are slow)
+    for size in args.sizes:
+        for map_name, make_map in MAPS.items():
+            m = make_map(size)
+            variants = [('default', {}), ('low_memory', {'low_memory': True}), ('no_crop', {'crop': False})]
+            if (os.cpu_count() or 1) > 1:
+                variants.append(('threads%d' % os.cpu_count(), {'threads': os.cpu_count()}))
+            for variant, kwargs in variants:
+                name = 'extend_and_soften_mask %s %d %s' % (map_name, size, variant)
+                if args.only and args.only not in name:
+                    continue
+                report.add(name, measure(masks.extend_and_soften_mask, m, 0.5, 3, 12, repeat=args.repeat, **kwargs),
+                           size=size, map=map_name, level=0.5, extend=3, width=12, **kwargs)
+
+
+def bench_tiled(report, args):
+    import chimerax_soft_edge_mask as masks
+    import chimerax_mrc_io as mrc_io
+    size = max(args.sizes)
+    name = 'soft_edge_mask_tiled blobs %d' % size
+    if args.only and args.only not in name:
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, 'in.mrc')
+        mrc_io.write_mrc(in_path, MAPS['blobs'](size), voxel_size=1.0)
+        out_path = os.path.join(tmp, 'out.mrc')
+        report.add(name, measure(masks.soft_edge_mask_tiled, in_path, out_path, 0.5, 3, 12, memory=256, log=lambda msg: None,
+                                 repeat=args.repeat), size=size, memory_mb=256)
+
+
+def check_tiled(args, size=96):
+    # Tiled output must equal the untiled mask, for an extend and a shrink (tiles the shrink empties included).
+    # Small memory budgets force several tiles. Returns the number of mismatches.
+    import numpy as np
+    import chimerax_soft_edge_mask as masks
+    import chimerax_mrc_io as mrc_io
+    if args.only and args.only not in 'soft_edge_mask_tiled':
+        return 0
+    failures = 0
+    m = MAPS['blobs'](size)
+    with tempfile.TemporaryDirectory() as tmp:
+        in_path = os.path.join(tmp, 'in.mrc')
+        mrc_io.write_mrc(in_path, m, voxel_size=1.0)
+        for extend, width, memory in ((3, 12, 12), (-2, 4, 6)):
+            out_path = os.path.join(tmp, 'out.mrc')
+            masks.soft_edge_mask_tiled(in_path, out_path, 0.5, extend, width, memory=memory, log=lambda msg: None)
+            tiled = np.asarray(mrc_io.open_data(out_path)[1])
+            difference = np.abs(tiled - masks.extend_and_soften_mask(m, 0.5, extend, width)).max()
+            print('%-55s %s (max difference %.3g)' % ('soft_edge_mask_tiled = untiled, extend %g width %g' % (extend, width),
+                                                     'ok' if difference == 0 else 'MISMATCH', difference))
+            failures += difference != 0
+            del tiled
+    return failures
+
+
+def bench_distance_scaling(report, args):
+    # Distance transform backends against the distance bound, on one thread and on all of them. The threaded
+    # backend does work in proportion to the bound, the others do not (see distance_transform.THREADED_MAX_DISTANCE).
+    import chimerax_distance_transform as dt
+    size = max(args.sizes)
+    mask = MAPS['blobs'](size) >= 0.5
+    counts = sorted({1, os.cpu_count() or 1})
+    for backend in dt.available_backends():
+        for threads in counts:
+            for bound in (2, 4, 8, 16, 32) if backend == 'threaded' else (None,):
+                name = 'distance_to_mask %s %d threads %d%s' % (backend, size, threads,
+                                                                 ' max %d' % bound if bound else '')
+                if args.only and args.only not in name:
+                    continue
+                report.add(name, measure(dt.distance_to_mask, mask, bound, threads=threads, backend=backend,
+                                         repeat=args.repeat), size=size, backend=backend, threads=threads,
+                           max_distance=bound)
+
+
+def bench_gaussian_splat(report, args):
+    import chimerax_molmap as molmap
+    size = max(args.sizes)
+    identity = ((1, 0, 0, 0), (0, 1, 0, 0), (0, 0, 1, 0))
+    for count in args.atoms:
+        name = 'molmap_values %d atoms %d' % (count, size)
+        if args.only and args.only not in name:
+            continue
+        xyz, masses = bench_common.atom_cloud(count, radius=0.4 * size)
+        xyz += size / 2.0
+        report.add(name, measure(molmap.molmap_values, identity, xyz, masses, (size, size, size), (1, 1, 1), 5.0,
+                                 repeat=args.repeat), atoms=count, size=size, resolution=5.0)
+
+
+def bench_is_planar(report, args):
+    import chimerax_align_symmetry_axis as sym_axis
+    for count in (3, 12, 60):
+        name = 'is_planar %d points' % count
+        if args.only and args.only not in name:
+            continue
+        points = bench_common.planar_ring(count)
+        report.add(name, measure(lambda: [sym_axis.is_planar(points) for _ in range(1000)], repeat=args.repeat),
+                   points=count, calls=1000)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the numpy kernels (no ChimeraX needed).')
+    bench_common.add_common_arguments(parser)
+    args = parser.parse_args(argv)
+    report = Report('kernels')
+    bench_masks(report, args)
+    bench_tiled(report, args)
+    failures = check_tiled(args)
+    bench_distance_scaling(report, args)
+    bench_gaussian_splat(report, args)
+    bench_is_planar(report, args)
+    return bench_common.finish(report, args) or int(failures > 0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
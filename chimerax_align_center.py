@@ -3,31 +3,8 @@
 
 import os
 import numpy as np
+from chimerax_centroids import define_centroid, forget_centroids, volume_center, grouped_centroids
 
-def define_centroid(session, atoms, mass_weighting=False): # from cmd_centroid
-    from chimerax.core.errors import UserError
-    from chimerax.centroids import centroid
-    from chimerax.atomic import AtomicStructure, concatenate
-    if atoms is None:
-        structures_atoms = [m.atoms for m in session.models if isinstance(m, AtomicStructure)]
-        if structures_atoms:
-            atoms = concatenate(structures_atoms)
-    if not atoms:
-        raise UserError("Atom specifier selects no atoms")
-    structures = atoms.unique_structures
-    if len(structures) > 1:
-        crds = atoms.scene_coords
-    else:
-        crds = atoms.scene_coords #was atoms.coords ?
-    if mass_weighting:
-        masses = atoms.elements.masses
-        avg_mass = masses.sum() / len(masses)
-        import numpy
-        weights = masses[:, numpy.newaxis] / avg_mass
-    else:
-        weights = None
-    xyz = centroid(crds, weights=weights)
-    return xyz
 
 def parse_map_or_atoms(session , atomspec):
     from chimerax.map import MapsArg
@@ -42,11 +19,10 @@ def parse_map_or_atoms(session , atomspec):
         return map[0][0]
 
 
-def align_center(session, model, to=None, MoveAtomSubset=False):
+def align_center(session, model, to=None, MoveAtomSubset=False, level=None, to_level=None, tolerance=1.0):
     from chimerax.core.commands import run
     from chimerax.atomic.molarray import Atoms
     from chimerax.map.volume import Volume
-    from chimerax.std_commands.measure_center import volume_center_of_mass
     from chimerax.core.commands import atomspec
 
     if type(model) == atomspec.AtomSpec:
@@ -61,11 +37,7 @@ def align_center(session, model, to=None, MoveAtomSubset=False):
         move_string = 'atoms'
     elif type(model) == Volume:
         model_id = '#'+model.id_string
-        model_center = volume_center_of_mass(model)
-        if np.isnan(model_center[0]):
-            raise ValueError("Map has no volume. Set threshold level to display density.")
-        model_xyz = model.data.ijk_to_xyz(model_center)
-        model_center = model.scene_position * model_xyz
+        model_center = volume_center(session, model, level=level, tolerance=tolerance)
         move_string = 'models'
     else:
         raise ValueError("Model type not recognised: %s" % str(type(model)))
@@ -76,11 +48,7 @@ def align_center(session, model, to=None, MoveAtomSubset=False):
             to_center = define_centroid(session, to)
         elif type(to) == Volume:
             to_id = '#'+to.id_string
-            to_center = volume_center_of_mass(to)
-            if np.isnan(to_center[0]):
-                raise ValueError("Map has no volume. Set threshold level to display density.")
-            to_xyz = to.data.ijk_to_xyz(to_center)
-            to_center = to.scene_position * to_xyz
+            to_center = volume_center(session, to, level=to_level, tolerance=tolerance)
         else:
             raise ValueError("'Model to' type not recognised: %s" % str(type(to)))
     else:
@@ -97,22 +65,96 @@ def align_center(session, model, to=None, MoveAtomSubset=False):
     cmd = 'move %0.2f,%0.2f,%0.2f %s %s' % (center_dif[0], center_dif[1], center_dif[2], move_string, model_id)
     print(cmd)
     run(session, cmd)
+    if move_string == 'atoms':
+        forget_centroids(session, model)
 
 
 
 
+def center_units(session, spec):
+    # Each map and each structure's atoms in spec, in model id order, as (model, atoms or None).
+    from chimerax.map.volume import Volume
+    results = spec.evaluate(session)
+    units = [(v, None) for v in results.models if isinstance(v, Volume)]
+    units += [(s, atoms) for s, atoms in results.atoms.by_structure]
+    units.sort(key=lambda unit: unit[0].id)
+    return units
+
+
+def unit_centers(session, units, level=None, tolerance=1.0):
+    # Scene coordinate centres of units (from center_units): all the atom centroids at once, then the maps.
+    centers = np.zeros((len(units), 3))
+    atom_units = [i for i, (m, atoms) in enumerate(units) if atoms is not None]
+    if atom_units:
+        centers[atom_units] = grouped_centroids([units[i][1] for i in atom_units])
+    for i, (m, atoms) in enumerate(units):
+        if atoms is None:
+            centers[i] = volume_center(session, m, level=level, tolerance=tolerance)
+    return centers
+
+
+def align_center_batch(session, models, to=None, MoveAtomSubset=False, level=None, to_level=None, tolerance=1.0):
+    # Many models at once: every map and structure in models is centred on the single target, or on the
+    # target with the same position in model id order. Shifts go straight to the positions (or atom
+    # coordinates) instead of through a move command per model, so ChimeraX redraws once.
+    from chimerax.core.errors import UserError
+    from chimerax.geometry import translation
+    from chimerax.atomic import concatenate
+    units = center_units(session, models)
+    if not units:
+        raise UserError("No maps or atoms specified.")
+    centers = unit_centers(session, units, level=level, tolerance=tolerance)
+    if to is not None:
+        to_units = center_units(session, to)
+        if len(to_units) not in (1, len(units)):
+            raise UserError("Give one target or one per model (%d models, %d targets)." % (len(units), len(to_units)))
+        to_centers = unit_centers(session, to_units, level=to_level, tolerance=tolerance)
+    else:
+        to_centers = np.array([session.main_view.center_of_rotation])
+    shifts = to_centers - centers
+    subsets = []
+    subset_shifts = []
+    for (m, atoms), shift in zip(units, shifts):
+        if atoms is not None and MoveAtomSubset:
+            subsets.append(atoms)
+            subset_shifts.append(np.broadcast_to(shift, (len(atoms), 3)))
+        else:
+            m.scene_position = translation(shift) * m.scene_position
+    if subsets:
+        atoms = concatenate(subsets)
+        atoms.scene_coords = atoms.scene_coords + np.concatenate(subset_shifts)
+        forget_centroids(session, atoms)
+    session.logger.status('Centred %d models (mean shift %.2f A)' % (len(units), np.linalg.norm(shifts, axis=1).mean()), log=True)
+    return shifts
+
+
 def register_command(logger):
-    from chimerax.core.commands import CmdDesc, register, ModelArg, StringArg, BoolArg, AtomSpecArg
+    from chimerax.core.commands import CmdDesc, register, ModelArg, StringArg, BoolArg, AtomSpecArg, FloatArg
     from chimerax.map import MapsArg
     from chimerax.atomic import AtomsArg
 
     desc = CmdDesc(
         required=[('model', AtomSpecArg)], #map or atoms
         keyword=[('to', AtomSpecArg), #map or atoms
-                 ('MoveAtomSubset', BoolArg)],
+                 ('MoveAtomSubset', BoolArg),
+                 ('level', FloatArg), #Map threshold for the centre of mass. Default encloses 1% of the voxels.
+                 ('to_level', FloatArg), #The same for a 'to' map
+                 ('tolerance', FloatArg)], #Allowed map centre error (A) for using a subsampled map. Default 1, 0 for full resolution.
         required_arguments=[],
         synopsis='Move a map to the center of some atoms (no rotation).')
     register('align center', desc, align_center, logger=logger)
 
+    desc = CmdDesc(
+        required=[('models', AtomSpecArg)], #maps and/or atoms, one unit per map or structure
+        keyword=[('to', AtomSpecArg), #one map or structure, or one per unit in models (in model id order)
+                 ('MoveAtomSubset', BoolArg),
+                 ('level', FloatArg), #Map threshold for the centre of mass. Default encloses 1% of the voxels.
+                 ('to_level', FloatArg), #The same for 'to' maps
+                 ('tolerance', FloatArg)], #Allowed map centre error (A) for using a subsampled map. Default 1.
+        required_arguments=[],
+        synopsis='Move many maps and models to the centers of one or many targets (no rotation).')
+    register('align center batch', desc, align_center_batch, logger=logger)
+
 
-register_command(session.logger)
\ No newline at end of file
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
\ No newline at end of file
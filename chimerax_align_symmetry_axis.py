@@ -3,31 +3,8 @@
 
 import os
 import numpy as np
+from chimerax_centroids import define_centroid
 
-def define_centroid(session, atoms, mass_weighting=False): # from cmd_centroid
-    from chimerax.core.errors import UserError
-    from chimerax.centroids import centroid
-    from chimerax.atomic import AtomicStructure, concatenate
-    if atoms is None:
-        structures_atoms = [m.atoms for m in session.models if isinstance(m, AtomicStructure)]
-        if structures_atoms:
-            atoms = concatenate(structures_atoms)
-    if not atoms:
-        raise UserError("Atom specifier selects no atoms")
-    structures = atoms.unique_structures
-    if len(structures) > 1:
-        crds = atoms.scene_coords
-    else:
-        crds = atoms.scene_coords #was atoms.coords ?
-    if mass_weighting:
-        masses = atoms.elements.masses
-        avg_mass = masses.sum() / len(masses)
-        import numpy
-        weights = masses[:, numpy.newaxis] / avg_mass
-    else:
-        weights = None
-    xyz = centroid(crds, weights=weights)
-    return xyz
 
 def is_planar(points, tolerance=1):
     points = np.asarray(points)
@@ -131,4 +108,5 @@ def register_command(logger):
     register('align symmetry axis', desc, align_sym_axis, logger=logger)
 
 
-register_command(session.logger)
\ No newline at end of file
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
\ No newline at end of file
@@ -0,0 +1,104 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Small least-recently-used caches with a memory cap, kept on the ChimeraX session so repeated commands can
+#reuse expensive intermediate results (distance maps, centroids, map statistics...).
+
+from collections import OrderedDict
+import weakref
+import numpy as np
+
+
+def value_nbytes(value):
+    # Approximate memory used by a cached value (numpy arrays in nested tuples/lists/dicts).
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        return sum(value_nbytes(v) for v in value.values())
+    if isinstance(value, (tuple, list)):
+        return sum(value_nbytes(v) for v in value)
+    return 64
+
+
+class LRUCache:
+    def __init__(self, max_bytes=2**30, max_items=None):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.entries = OrderedDict() # key -> (value, nbytes)
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = value_nbytes(value)
+        self.remove(key)
+        if nbytes > self.max_bytes:
+            return value # too big to keep
+        self.entries[key] = (value, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes or (self.max_items is not None and len(self.entries) > self.max_items):
+            old_key, (old_value, old_nbytes) = self.entries.popitem(last=False)
+            self.nbytes -= old_nbytes
+        return value
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry[1]
+
+    def remove_if(self, test):
+        for key in [key for key in self.entries if test(key)]:
+            self.remove(key)
+
+    def remove_closed(self):
+        # Drop entries keyed by data_key whose map has gone (the weak reference is dead).
+        self.remove_if(lambda key: isinstance(key, tuple) and key and isinstance(key[0], weakref.ref)
+                       and key[0]() is None)
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+def session_cache(session, name, max_bytes=2**30, max_items=None):
+    # One named LRUCache per session, created on first use.
+    caches = getattr(session, '_custom_command_caches', None)
+    if caches is None:
+        caches = session._custom_command_caches = {}
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches[name] = LRUCache(max_bytes=max_bytes, max_items=max_items)
+    cache.remove_closed()
+    return cache
+
+
+def data_version(grid_data):
+    # Counter that goes up whenever the values of a map's GridData change.
+    if not hasattr(grid_data, '_custom_data_version'):
+        grid_data._custom_data_version = 0
+        data_ref = weakref.ref(grid_data)
+
+        def values_changed(change_type):
+            data = data_ref()
+            if data is not None and change_type == 'values changed':
+                data._custom_data_version += 1
+        grid_data.add_change_callback(values_changed)
+    return grid_data._custom_data_version
+
+
+def data_key(grid_data):
+    # Cache key for the current values of a map. A weak reference compares equal only while it refers to
+    # the same live object, so entries for closed maps can never match a new map that reuses the id.
+    return (weakref.ref(grid_data), data_version(grid_data))
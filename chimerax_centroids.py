@@ -0,0 +1,147 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Atom centroids shared by the centring commands (align center, align symmetry axis, molmap cube, to residue).
+#Results are cached per session and dropped when ChimeraX reports that the coordinates or the position of
+#one of the structures (or a parent model) changed, or that atoms were deleted. Atomic changes are only
+#reported at frame time, so commands that move atoms and may need their centroids again before then (align center
+#with MoveAtomSubset) call forget_centroids themselves.
+#Map centres of mass (align center) are cached per map, data version, threshold and sampling step, in grid
+#index coordinates so moving the map does not invalidate them.
+
+import numpy as np
+from chimerax_cache import session_cache
+
+CENTROID_CACHE_BYTES = 2**28
+CENTROID_CACHE_ITEMS = 1024
+VOLUME_CENTER_CACHE_ITEMS = 256
+AUTO_LEVEL_FRACTION = 0.01 # as ChimeraX's initial surface level, the level enclosing 1% of the voxels
+
+
+def structure_model_ids(atoms):
+    # ids of the structures of atoms and all their parent models (moving any of them moves the atoms)
+    ids = set()
+    for s in atoms.unique_structures:
+        m = s
+        while m is not None:
+            ids.add(id(m))
+            m = getattr(m, 'parent', None)
+    return frozenset(ids)
+
+
+def centroid_cache(session):
+    cache = session_cache(session, 'centroids', max_bytes=CENTROID_CACHE_BYTES, max_items=CENTROID_CACHE_ITEMS)
+    if not getattr(cache, 'triggers_added', False):
+        from chimerax.atomic import get_triggers
+        from chimerax.core.models import MODEL_POSITION_CHANGED
+
+        def atoms_changed(trigger_name, changes):
+            if changes.num_deleted_atoms() > 0:
+                cache.clear() # atom pointers can be reused, so forget everything
+            elif 'coord changed' in changes.atom_reasons() or 'active_coordset changed' in changes.structure_reasons():
+                moved = set(id(s) for s in changes.modified_structures())
+                moved.update(id(s) for s in changes.modified_atoms().unique_structures)
+                cache.remove_if(lambda key: not moved.isdisjoint(key[-1]))
+
+        def position_changed(trigger_name, model):
+            cache.remove_if(lambda key: id(model) in key[-1])
+
+        get_triggers().add_handler('changes', atoms_changed)
+        session.triggers.add_handler(MODEL_POSITION_CHANGED, position_changed)
+        cache.triggers_added = True
+    return cache
+
+
+def forget_centroids(session, atoms):
+    # Drop cached centroids of the structures of atoms, after moving them without waiting for the next frame.
+    ids = structure_model_ids(atoms)
+    centroid_cache(session).remove_if(lambda key: not ids.isdisjoint(key[-1]))
+
+
+def atoms_centroid(atoms, mass_weighting=False):
+    # Centroid of the scene coordinates, uncached (from cmd_centroid)
+    from chimerax.centroids import centroid
+    crds = atoms.scene_coords
+    if mass_weighting:
+        masses = atoms.elements.masses
+        avg_mass = masses.sum() / len(masses)
+        weights = masses[:, np.newaxis] / avg_mass
+    else:
+        weights = None
+    return centroid(crds, weights=weights)
+
+
+def grouped_centroids(atoms_list):
+    # Centroids (scene coordinates) of many sets of atoms in one pass: one coordinate fetch and a bincount per axis.
+    from chimerax.atomic import concatenate
+    counts = np.array([len(a) for a in atoms_list])
+    xyz = concatenate(atoms_list).scene_coords
+    group = np.repeat(np.arange(len(atoms_list)), counts)
+    sums = np.stack([np.bincount(group, weights=xyz[:, axis], minlength=len(atoms_list)) for axis in range(3)], axis=1)
+    return sums / counts[:, None]
+
+
+def define_centroid(session, atoms, mass_weighting=False):
+    # Centroid (scene coordinates) of atoms, or of all atomic structures if atoms is None.
+    # The cache key is a cheap fingerprint of the atom pointers. A hit is confirmed against the stored pointers.
+    from chimerax.core.errors import UserError
+    from chimerax.atomic import AtomicStructure, concatenate
+    if atoms is None:
+        structures_atoms = [m.atoms for m in session.models if isinstance(m, AtomicStructure)]
+        if structures_atoms:
+            atoms = concatenate(structures_atoms)
+    if not atoms:
+        raise UserError("Atom specifier selects no atoms")
+    cache = centroid_cache(session)
+    pointers = np.asarray(atoms.pointers).view(np.uint64)
+    key = (len(pointers), int(pointers.sum()), int((pointers * pointers).sum()), bool(mass_weighting),
+           structure_model_ids(atoms))
+    entry = cache.get(key)
+    if entry is not None and np.array_equal(entry[0], pointers):
+        return entry[1].copy()
+    xyz = atoms_centroid(atoms, mass_weighting)
+    cache.put(key, (pointers.copy(), xyz))
+    return xyz.copy()
+
+
+def mipmap_step(data, tolerance=1.0, min_size=32):
+    # Largest power of 2 subsampling step for which half a subsampled voxel is within tolerance (Angstrom),
+    # keeping at least min_size voxels along every axis. 1 (full resolution) if tolerance is 0.
+    step = 1
+    while (step * max(data.step) <= tolerance and min(data.size) // (2 * step) >= min_size):
+        step *= 2
+    return step
+
+
+def grid_center_of_mass(m, level=None):
+    # Centre of mass (x, y, z voxel indices) of the values of m (z, y, x) at or above level, and the level used.
+    # Without a level the one enclosing AUTO_LEVEL_FRACTION of the voxels is used. None if there is no mass.
+    m = np.asarray(m)
+    if level is None:
+        level = float(np.quantile(m, 1 - AUTO_LEVEL_FRACTION))
+    w = np.where(m >= level, m, 0).astype(np.float64, copy=False)
+    total = w.sum()
+    if not total > 0:
+        return None, level
+    center = [float(np.dot(w.sum(axis=tuple(a for a in range(3) if a != axis)), np.arange(m.shape[axis]))) / total
+              for axis in (2, 1, 0)]
+    return np.array(center), level
+
+
+def volume_center(session, v, level=None, tolerance=1.0):
+    # Scene coordinates of the centre of mass of map v above level (see grid_center_of_mass), computed from
+    # the map subsampled by mipmap_step(tolerance) and cached per map, data version, level and step.
+    from chimerax.core.errors import UserError
+    from chimerax_cache import session_cache, data_key
+    data = v.data
+    step = mipmap_step(data, tolerance)
+    cache = session_cache(session, 'volume centers', max_items=VOLUME_CENTER_CACHE_ITEMS)
+    key = data_key(data) + (level, step)
+    ijk = cache.get(key)
+    if ijk is None:
+        m = data.matrix(ijk_size=data.size, ijk_step=(step, step, step))
+        center, used_level = grid_center_of_mass(m, level)
+        if center is None:
+            raise UserError("Map #%s has no density above level %.4g." % (v.id_string, used_level))
+        ijk = cache.put(key, center * step)
+    return v.scene_position * data.ijk_to_xyz(ijk)
@@ -0,0 +1,116 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Euclidean distance transforms for the mask commands, with a choice of backends:
+#  scipy     scipy.ndimage.distance_transform_edt (single core, float64, exact)
+#  threaded  bounded transform in numpy: a windowed minimum along each axis in turn (within max_distance), each
+#            pass split over a thread pool. Exact up to max_distance only, and needs one, so without it
+#            distance_to_mask falls back to scipy (and says so). Within max_distance it matches scipy exactly.
+#  edt       the optional "edt" package (pip install edt), multithreaded C++, exact but float32 (scipy's values
+#            rounded to float32)
+#Other backends can be added with register_backend.
+#The threaded backend's work grows with max_distance while scipy's does not: on one core it takes about 0.07 x
+#max_distance of scipy's time for a 192^3 box and 0.14 x for 96^3 (benchmarks/bench_kernels.py, distance_to_mask),
+#so it is only picked by default up to THREADED_MAX_DISTANCE, where two threads already beat scipy on small boxes.
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+THREADED_MAX_DISTANCE = 8 # voxels, largest bound the threaded backend is used for by default
+
+
+def bounded_squared_distances(mask, max_distance, threads=1):
+    # Squared distance from every voxel to the nearest True voxel of mask, computed in float32 one axis
+    # at a time. Only exact up to max_distance. Anything further away is reported as larger than max_distance**2.
+    # Uses ~4 bytes/voxel plus one slab per thread, instead of the ~20 bytes/voxel of distance_transform_edt.
+    r = int(np.ceil(max_distance))
+    far = np.float32((r + 1) ** 2)
+    d2 = np.full(mask.shape, far, dtype=np.float32)
+    d2[mask] = 0.0
+
+    def min_along_lines(d, j0, j1):
+        for j in range(j0, j1): # one slab at a time keeps the working copy small
+            line = d[:, j]
+            src = line.copy()
+            for k in range(1, min(r, len(src) - 1) + 1):
+                np.minimum(line[k:], src[:-k] + k * k, out=line[k:])
+                np.minimum(line[:-k], src[k:] + k * k, out=line[:-k])
+
+    for axis in range(d2.ndim):
+        d = np.moveaxis(d2, axis, 0)
+        if threads > 1:
+            edges = np.linspace(0, d.shape[1], min(threads, d.shape[1]) + 1).astype(int)
+            with ThreadPoolExecutor(max_workers=threads) as pool:
+                list(pool.map(lambda j: min_along_lines(d, edges[j], edges[j + 1]), range(len(edges) - 1)))
+        else:
+            min_along_lines(d, 0, d.shape[1])
+    np.minimum(d2, far, out=d2)
+    return d2
+
+
+def scipy_distances(mask, max_distance=None, threads=1):
+    from scipy.ndimage import distance_transform_edt
+    return distance_transform_edt(~mask)
+
+
+def threaded_distances(mask, max_distance=None, threads=1):
+    if max_distance is None:
+        raise ValueError("The threaded distance transform needs a max_distance.")
+    d2 = bounded_squared_distances(mask, max_distance, threads=threads)
+    distances = np.empty(mask.shape, dtype=float)
+    for d, slab in zip(distances, d2):
+        np.sqrt(slab, out=d, dtype=float)
+    return distances
+
+
+def edt_package_distances(mask, max_distance=None, threads=1):
+    import edt
+    return edt.edt(np.ascontiguousarray(~mask), black_border=False, parallel=threads)
+
+
+backends = {'scipy': scipy_distances, 'threaded': threaded_distances, 'edt': edt_package_distances}
+
+
+def register_backend(name, func):
+    # func(mask, max_distance=None, threads=1) -> distance from each voxel to the nearest True voxel of mask
+    backends[name] = func
+
+
+def available_backends():
+    names = []
+    for name in backends:
+        if name == 'edt':
+            try:
+                import edt
+            except ImportError:
+                continue
+        names.append(name)
+    return names
+
+
+def default_backend(threads=1, max_distance=None):
+    # Single threaded: scipy. Multithreaded: the edt package if installed, otherwise the numpy thread pool for
+    # bounds up to THREADED_MAX_DISTANCE and scipy beyond that.
+    if threads <= 1:
+        return 'scipy'
+    if 'edt' in available_backends():
+        return 'edt'
+    if max_distance is not None and max_distance <= THREADED_MAX_DISTANCE:
+        return 'threaded'
+    return 'scipy'
+
+
+def distance_to_mask(mask, max_distance=None, threads=1, backend=None, log=print):
+    # Euclidean distance (in voxels) from each voxel to the nearest True voxel of mask. Distances up to
+    # max_distance are exact; the threaded backend only guarantees values beyond that are > max_distance.
+    # Backends that cannot run (edt not installed, threaded without max_distance) fall back to scipy on one
+    # core, reported with log.
+    if backend is None:
+        backend = default_backend(threads, max_distance)
+    if backend not in available_backends():
+        log("Distance transform backend %s is not available, using scipy (single threaded)." % backend)
+        backend = 'scipy'
+    elif backend == 'threaded' and max_distance is None:
+        log("The threaded distance transform needs a maximum distance, using scipy (single threaded).")
+        backend = 'scipy'
+    return backends[backend](mask, max_distance=max_distance, threads=threads)
@@ -3,6 +3,7 @@
 
 import os
 import numpy as np
+from chimerax_fit_search import symmetry_operators, symmetric_refine
 
 def is_map_or_atoms(session, atomspec):
     from chimerax.map import MapsArg
@@ -33,17 +34,6 @@ def fit_opposite_hand(session, atoms_or_map, inmap, search=50, radius=50, sym=Fa
         run(session, cmd)
 
 
-    if sym and not ismap:
-        orig_models = session.models._models.copy()
-        cmd = 'sym %s biomt' % atoms_or_map_id
-        print(cmd)
-        run(session, cmd)
-        dif = session.models._models.keys()-orig_models #find new id
-        new_ids = [key for key in dif if len(key) == 1]
-        if len(new_ids) > 0:
-            atoms_or_map_id = '#'+str(new_ids[0][0])
-
-
     #flip map
     cmd = 'volume flip %s' % (map_id)
     print(cmd)
@@ -56,6 +46,9 @@ def fit_opposite_hand(session, atoms_or_map, inmap, search=50, radius=50, sym=Fa
     a = AtomicStructuresArg()
     A = a.parse(atoms_or_map_id, session)
     atoms_or_map = combine_cmd(session, A[0])
+    symmetric = sym and not ismap
+    if symmetric: #keep the BIOMT operators for symmetric fitting of the copy
+        atoms_or_map.metadata = dict(A[0][0].metadata)
 
     #hide old map
     cmd = 'hide %s models' % atoms_or_map_id
@@ -75,11 +68,22 @@ def fit_opposite_hand(session, atoms_or_map, inmap, search=50, radius=50, sym=Fa
 
     if not SkipRoughFit:
         #fit in map
-        cmd = 'rough fitmap %s inmap %s search %d radius %d refine %s' % (atoms_or_map_id, flipped_volume_id, search, radius, "False")
+        #with sym, rough fitmap refines the whole assembly itself (a plain fitmap would fit one copy)
+        cmd = 'rough fitmap %s inmap %s search %d radius %d refine %s sym %s' % (atoms_or_map_id, flipped_volume_id, search, radius,
+                                                                             symmetric and refine, symmetric)
         print(cmd)
         run(session, cmd)
 
-    if refine: #repeat fitmap command without search
+    if refine and symmetric and SkipRoughFit: #fit the whole assembly, as rough fitmap sym does
+        from chimerax.core.errors import UserError
+        operators = symmetry_operators(atoms_or_map)
+        if operators is None:
+            raise UserError("No BIOMT (assembly) operators found for %s." % atoms_or_map_id)
+        symmetric_refine(session, atoms_or_map.atoms, flipped_volume, operators)
+        cmd = 'sym %s biomt newModel false' % atoms_or_map_id
+        print(cmd)
+        run(session, cmd)
+    elif refine and not symmetric: #repeat fitmap command without search
         cmd = 'fitmap %s inmap %s' % (atoms_or_map_id, flipped_volume_id)
         print(cmd)
         run(session, cmd)
@@ -111,7 +115,7 @@ def register_command(logger):
         keyword=[('inmap', MapsArg),
                  ('search', IntArg), #default 50
                  ('radius', IntArg), #default 50
-                 ('sym', BoolArg), #default False uses biomt in file header
+                 ('sym', BoolArg), #default False. Fit the assembly from the biomt in the file header.
                  ('refine', BoolArg), #default True
                  ('SkipRoughFit', BoolArg)], #default False
         required_arguments=['atoms_or_map', 'inmap'],
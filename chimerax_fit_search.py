@@ -0,0 +1,555 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Global rigid body search of atoms in a map with numpy/scipy, for rough fitmap (engine numpy):
+#  random_starts   seeded random rotations and shifts (within radius) of the atoms about their centre
+#  local_fit       L-BFGS maximisation of the mean map value at the atom positions, with analytic gradients
+#                  from gradient volumes and the rotation vector Jacobian
+#  fit_search      all starts, split across worker processes, merged into one ranked list (or, with converge,
+#                  rounds of starts until the best cluster of poses is large enough and its score has settled)
+#  cluster_poses   fitmap style clustering of poses by rotation angle and shift
+#  fft_search      exhaustive search over a rotation grid, every shift at once by FFT cross-correlation
+#  multiresolution_search   fit_search (or fft_search) on a binned map with fewer atoms, then the best poses
+#                  refined on finer maps
+#  fit_metrics     mean map value, atoms inside the contour, overlap and correlation of a fitted model
+#  symmetry_operators, symmetric_refine   BIOMT operators of a structure and a local fit of the whole assembly
+#                  (these two and apply_transform need ChimeraX, the rest only numpy/scipy)
+#Poses are 3x4 scene coordinate transforms applied to the atoms' current positions. The starts are all drawn
+#before any work is handed out, and each start is fitted on its own, so the ranked list does not depend on
+#the number of worker processes.
+#With symmetry operators (n_ops x 3 x 4, e.g. BIOMT) only the asymmetric unit is given: the copies are made by a
+#batched matrix product each time the score is evaluated, and poses move the whole assembly about its centre.
+
+import os
+import itertools
+import numpy as np
+from chimerax_orientations import projection_angles, euler_matrices
+from chimerax_molmap import molmap_values
+
+search_state = {} # per process: the maps init_search was given (sent once to each worker) and the current atoms
+setup_keys = itertools.count() # one per fit_poses call, so workers only set up each set of atoms once
+
+
+def rotation_matrices(rotvecs):
+    # Rotation matrices (n x 3 x 3) from rotation vectors (n x 3, axis times angle in radians), Rodrigues' formula.
+    rotvecs = np.asarray(rotvecs, dtype=np.float64).reshape(-1, 3)
+    theta = np.linalg.norm(rotvecs, axis=1)
+    k = rotvecs / np.where(theta > 0, theta, 1)[:, None]
+    kx = np.zeros((len(k), 3, 3))
+    kx[:, 0, 1], kx[:, 0, 2], kx[:, 1, 2] = -k[:, 2], k[:, 1], -k[:, 0]
+    kx -= kx.transpose(0, 2, 1)
+    s, c = np.sin(theta)[:, None, None], np.cos(theta)[:, None, None]
+    return np.eye(3) + s * kx + (1 - c) * (kx @ kx)
+
+
+def left_jacobian(rotvec):
+    # Maps a change of rotation vector to the small extra rotation it makes (R(w + dw) = R(J dw) R(w)).
+    theta = np.linalg.norm(rotvec)
+    wx = np.array([[0, -rotvec[2], rotvec[1]], [rotvec[2], 0, -rotvec[0]], [-rotvec[1], rotvec[0], 0]])
+    if theta < 1e-6:
+        return np.eye(3) + 0.5 * wx
+    return np.eye(3) + (1 - np.cos(theta)) / theta ** 2 * wx + (theta - np.sin(theta)) / theta ** 3 * (wx @ wx)
+
+
+def random_rotations(rng, count):
+    # Uniformly distributed rotations, from normalised 4D Gaussian samples (unit quaternions w, x, y, z).
+    q = rng.standard_normal((count, 4))
+    q /= np.linalg.norm(q, axis=1)[:, None]
+    w, x, y, z = q.T
+    return np.stack([np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=1),
+                     np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=1),
+                     np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=1)], axis=1)
+
+
+def random_starts(count, radius, seed=None):
+    # count random rotations and shifts distributed uniformly within a ball of radius (Angstrom).
+    rng = np.random.default_rng(seed)
+    rotations = random_rotations(rng, count)
+    directions = rng.standard_normal((count, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, None]
+    shifts = directions * (radius * rng.random(count) ** (1 / 3))[:, None]
+    return rotations, shifts
+
+
+def gradient_stack(values):
+    # Map values and their x, y, z gradients (per voxel) as one float32 array of shape (4, nz, ny, nx).
+    # A stack is returned as it is, so precomputed ones (chimerax_map_cache) can be passed wherever values are.
+    values = np.asarray(values, dtype=np.float32)
+    if values.ndim == 4:
+        return values
+    stack = np.empty((4,) + values.shape, dtype=np.float32)
+    stack[0] = values
+    for channel, axis in ((1, 2), (2, 1), (3, 0)):
+        stack[channel] = np.gradient(values, axis=axis)
+    return stack
+
+
+def plain_values(values):
+    # The map values of a map or of its gradient_stack.
+    values = np.asarray(values, dtype=np.float32)
+    return values[0] if values.ndim == 4 else values
+
+
+def interpolate(stack, ijk):
+    # Trilinear interpolation of every channel of stack (c, nz, ny, nx) at ijk (n x 3, x, y, z voxel indices).
+    # Returns (c, n), zero for points whose interpolation cell is not inside the map.
+    c, nz, ny, nx = stack.shape
+    i0 = np.floor(ijk).astype(np.intp)
+    inside = np.all((i0 >= 0) & (i0 < np.array([nx - 1, ny - 1, nz - 1])), axis=1)
+    out = np.zeros((c, len(ijk)), dtype=np.float32)
+    if not inside.any():
+        return out
+    i0 = i0[inside]
+    t = (ijk[inside] - i0).astype(np.float32)
+    base = (i0[:, 2] * ny + i0[:, 1]) * nx + i0[:, 0]
+    flat = stack.reshape(c, -1)
+    acc = np.zeros((c, len(base)), dtype=np.float32)
+    for dz in (0, 1):
+        wz = t[:, 2] if dz else 1 - t[:, 2]
+        for dy in (0, 1):
+            wzy = wz * (t[:, 1] if dy else 1 - t[:, 1])
+            for dx in (0, 1):
+                w = wzy * (t[:, 0] if dx else 1 - t[:, 0])
+                acc += flat[:, base + ((dz * ny + dy) * nx + dx)] * w
+    out[:, inside] = acc
+    return out
+
+
+def symmetry_frame(xyz, operators=None):
+    # Centre of the assembly that operators (n_ops x 3 x 4, scene coordinates, or None for just the atoms) make from
+    # the atoms, and the operators as rotations L and shifts d about it: copy k of centre + x is centre + L[k] x + d[k].
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if operators is None:
+        return xyz.mean(axis=0), np.eye(3)[None], np.zeros((1, 3))
+    operators = np.asarray(operators, dtype=np.float64).reshape(-1, 3, 4)
+    rotations, shifts = operators[:, :, :3], operators[:, :, 3]
+    center = (xyz.mean(axis=0) @ rotations.transpose(0, 2, 1) + shifts).mean(axis=0)
+    return center, rotations, center @ rotations.transpose(0, 2, 1) + shifts - center
+
+
+def symmetry_points(offsets, rotation, rotations, shifts):
+    # Every copy (symmetry_frame rotations and shifts) of the atom offsets from the assembly centre, turned by
+    # rotation, as one batched product. Returns (n_ops * n) x 3 offsets from the centre.
+    turned = rotation @ rotations
+    return (offsets @ turned.transpose(0, 2, 1) + (shifts @ rotation.T)[:, None, :]).reshape(-1, 3)
+
+
+def init_search(maps):
+    # Map values (z, y, x) or gradient stacks, e.g. the levels of a map pyramid, kept for the local fits in this
+    # process.
+    search_state.clear()
+    search_state['maps'] = [gradient_stack(values) for values in maps]
+
+
+def end_search():
+    # Release what init_search and set_atoms kept (search_runner calls this when running in this process).
+    search_state.clear()
+
+
+def search_runner(maps, jobs=1):
+    # TaskRunner whose workers hold maps (see init_search), for fit_poses on any of them (by level) with any atoms.
+    from chimerax_parallel import TaskRunner
+    return TaskRunner(jobs, init_search, (maps,), finalizer=end_search)
+
+
+def share_atoms(runner, xyz_to_ijk, xyz, operators=None):
+    # What the tasks of one fit_poses call carry to set_atoms: the arrays themselves when the runner works in this
+    # process, otherwise the path of a temporary .npz file holding them, so each worker reads them once instead
+    # of every task pickling them. Remove the file (atoms_file) when done.
+    atoms = {'xyz_to_ijk': np.asarray(xyz_to_ijk, dtype=np.float64), 'xyz': np.asarray(xyz, dtype=np.float64)}
+    if operators is not None:
+        atoms['operators'] = np.asarray(operators, dtype=np.float64)
+    if runner.serial:
+        return atoms
+    import tempfile
+    with tempfile.NamedTemporaryFile(prefix='fit_atoms_', suffix='.npz', delete=False) as f:
+        np.savez(f, **atoms)
+    return f.name
+
+
+def atoms_file(atoms):
+    # The temporary file made by share_atoms, or None.
+    return atoms if isinstance(atoms, str) else None
+
+
+def set_atoms(setup):
+    # Atoms for the local fits in this process: setup is (key, map level, share_atoms result). Skipped if the key
+    # has not changed.
+    key, level, atoms = setup
+    if search_state.get('key') == key:
+        return
+    if atoms_file(atoms) is not None:
+        with np.load(atoms) as f:
+            atoms = {name: f[name] for name in f.files}
+    xyz_to_ijk, xyz, operators = atoms['xyz_to_ijk'], atoms['xyz'], atoms.get('operators')
+    center, rotations, shifts = symmetry_frame(xyz, operators)
+    search_state['key'] = key
+    search_state['stack'] = search_state['maps'][level]
+    search_state['xyz_to_ijk'] = np.asarray(xyz_to_ijk, dtype=np.float64)
+    search_state['center'] = center
+    search_state['offsets'] = xyz - center
+    search_state['symmetry'] = (rotations, shifts)
+    points = symmetry_points(search_state['offsets'], np.eye(3), rotations, shifts)
+    search_state['scale'] = max(float(np.sqrt((points ** 2).sum(axis=1).mean())), 1.0)
+
+
+def mean_value(stack, xyz_to_ijk, points):
+    # Mean map value at points (scene coordinates) and its gradient with respect to each point (n x 3).
+    a = xyz_to_ijk[:, :3]
+    vg = interpolate(stack, points @ a.T + xyz_to_ijk[:, 3])
+    return float(vg[0].mean(dtype=np.float64)), vg[1:].T.astype(np.float64) @ a
+
+
+def local_fit(rotation, shift, max_steps=100):
+    # Maximise the mean map value from the start pose (rotation about the atom centre, then shift).
+    # Parameters are a rotation vector (scaled by the atoms' radius of gyration, so all are in Angstrom) and a
+    # shift applied after the start pose. Returns (score, rotation, shift) of the final pose.
+    from scipy.optimize import minimize
+    stack, xyz_to_ijk = search_state['stack'], search_state['xyz_to_ijk']
+    center, scale, offsets = search_state['center'], search_state['scale'], search_state['offsets']
+    rotations, shifts = search_state['symmetry']
+
+    def negative_score(p):
+        w = p[:3] / scale
+        moved = symmetry_points(offsets, rotation_matrices(w)[0] @ rotation, rotations, shifts)
+        n = len(moved)
+        score, grad = mean_value(stack, xyz_to_ijk, moved + (center + shift + p[3:]))
+        torque = np.cross(moved, grad).sum(axis=0) / n
+        d_rotation = left_jacobian(w).T @ torque / scale
+        return -score, -np.concatenate([d_rotation, grad.sum(axis=0) / n])
+
+    result = minimize(negative_score, np.zeros(6), jac=True, method='L-BFGS-B', options={'maxiter': max_steps})
+    r = rotation_matrices(result.x[:3] / scale)[0]
+    return -float(result.fun), r @ rotation, shift + result.x[3:]
+
+
+def fit_starts(setup, rotations, shifts, max_steps=100):
+    # local_fit for each start (run in a worker after init_search), with the atoms of setup (see set_atoms).
+    set_atoms(setup)
+    return [local_fit(r, s, max_steps) for r, s in zip(rotations, shifts)]
+
+
+def pose_transform(rotation, shift, center):
+    # 3x4 scene transform for a rotation about center followed by a shift.
+    return np.concatenate([rotation, (center + shift - rotation @ center)[:, None]], axis=1)
+
+
+def start_shifts(transforms, center):
+    # Rotations and shifts (about center) of 3x4 scene transforms, to start local fits from known poses.
+    rotations = transforms[:, :, :3]
+    return rotations, transforms[:, :, 3] + rotations @ center - center
+
+
+CLUSTER_ANGLE = 6.0 # degrees, as fitmap
+CLUSTER_SHIFT = 3.0 # Angstrom, as fitmap
+ROUND_STARTS = 16 # starts per round when stopping early, fixed so the result does not depend on the number of jobs
+CONVERGE_TOLERANCE = 1e-4 # relative change of the best score between rounds that counts as settled
+
+
+def pose_distances(transform, transforms, center):
+    # Rotation angle (degrees) and distance moved by center between one 3x4 transform and each of transforms.
+    relative = transforms[:, :, :3] @ transform[:, :3].T
+    cos = (np.trace(relative, axis1=1, axis2=2) - 1) / 2
+    angles = np.degrees(np.arccos(np.clip(cos, -1, 1)))
+    moved = transforms[:, :, :3] @ center + transforms[:, :, 3]
+    shifts = np.linalg.norm(moved - (transform[:, :3] @ center + transform[:, 3]), axis=1)
+    return angles, shifts
+
+
+def cluster_poses(transforms, center, angle=CLUSTER_ANGLE, shift=CLUSTER_SHIFT):
+    # Greedy clustering of transforms ordered best first, as fitmap: each joins the first cluster whose first
+    # (best) pose is within angle degrees and shift Angstrom of it at center, or starts a new one. Returns the
+    # cluster of each pose, the cluster sizes and the first pose of each cluster (so clusters are best first).
+    labels = np.empty(len(transforms), dtype=np.intp)
+    heads = []
+    for i, transform in enumerate(transforms):
+        if heads:
+            angles, shifts = pose_distances(transform, transforms[heads], center)
+            close = np.flatnonzero((angles <= angle) & (shifts <= shift))
+            if len(close):
+                labels[i] = close[0]
+                continue
+        labels[i] = len(heads)
+        heads.append(i)
+    return labels, np.bincount(labels, minlength=len(heads)), np.array(heads, dtype=np.intp)
+
+
+def converged(scores, transforms, center, converge, last_best):
+    # Early stopping test after a round: the best cluster has at least converge poses and the best score has
+    # changed by no more than CONVERGE_TOLERANCE since the last round.
+    labels, sizes, heads = cluster_poses(transforms, center)
+    return (sizes[0] >= converge and last_best is not None
+            and abs(scores[0] - last_best) <= CONVERGE_TOLERANCE * abs(scores[0]))
+
+
+def fit_poses(values, xyz_to_ijk, xyz, rotations, shifts, jobs=1, max_steps=100, progress=None, operators=None,
+              converge=None, log=None, runner=None, level=0):
+    # local_fit from each start, split across worker processes. Returns scores and 3x4 scene transforms (best
+    # first), and the start each came from. Ties keep start order, so the list is the same for any number of jobs.
+    # With converge, starts are fitted in rounds of ROUND_STARTS and the rest are skipped once converged() says so.
+    # With a runner (search_runner) its workers and map level are used and values is ignored. Otherwise workers
+    # are started for values and stopped (or the map released from this process) on return.
+    count = len(rotations)
+    if count == 0:
+        return np.zeros(0), np.zeros((0, 3, 4)), np.zeros(0, dtype=np.intp)
+    center = symmetry_frame(xyz, operators)[0]
+    rounds = [np.arange(count)] if not converge else [np.arange(r, min(r + ROUND_STARTS, count))
+                                                      for r in range(0, count, ROUND_STARTS)]
+    own_runner = runner is None
+    if own_runner:
+        runner, level = search_runner([values], min(count, jobs)), 0
+    atoms = share_atoms(runner, xyz_to_ijk, xyz, operators)
+    setup = (next(setup_keys), level, atoms)
+    fits = []
+    last_best = None
+    try:
+        for starts in rounds:
+            chunks = np.array_split(starts, min(len(starts), max(1, jobs) * 4))
+            tasks = [(fit_starts, (setup, rotations[c], shifts[c], max_steps), {}) for c in chunks if len(c)]
+            done = len(fits)
+            report = None if progress is None else (lambda i, n, total: progress(i, done + n, count))
+            fits.extend(fit for chunk in runner.run(tasks, report) for fit in chunk)
+            scores = np.array([score for score, r, s in fits])
+            transforms = np.array([pose_transform(r, s, center) for score, r, s in fits])
+            order = np.argsort(-scores, kind='stable')
+            if converge and converged(scores[order], transforms[order], center, converge, last_best):
+                if log is not None and len(fits) < count:
+                    log('Converged after %d of %d starts' % (len(fits), count))
+                break
+            last_best = scores[order[0]]
+    finally:
+        if own_runner:
+            runner.close()
+        if atoms_file(atoms) is not None:
+            os.remove(atoms)
+    return scores[order], transforms[order], order
+
+
+def fit_search(values, xyz_to_ijk, xyz, count=50, radius=50.0, seed=None, jobs=1, max_steps=100, progress=None,
+               operators=None, converge=None, log=None, runner=None, level=0):
+    # Random start global search (see fit_poses for what is returned).
+    rotations, shifts = random_starts(count, radius, seed)
+    return fit_poses(values, xyz_to_ijk, xyz, rotations, shifts, jobs=jobs, max_steps=max_steps, progress=progress,
+                     operators=operators, converge=converge, log=log, runner=runner, level=level)
+
+
+def rotation_grid(angle_step):
+    # Roughly uniform rotations about angle_step degrees apart: evenly spread directions, each with in-plane turns.
+    return euler_matrices(projection_angles(step=angle_step, psi_step=angle_step))
+
+
+def splat_trilinear(ijk, shape):
+    # Atoms (x, y, z voxel indices) spread over the 8 voxels around each with trilinear weights, as a float32 grid
+    # (z, y, x). Correlating this with a map gives the sum of the interpolated map values at the atoms (as interpolate).
+    nz, ny, nx = shape
+    i0 = np.floor(ijk).astype(np.intp)
+    inside = np.all((i0 >= 0) & (i0 < np.array([nx - 1, ny - 1, nz - 1])), axis=1)
+    i0 = i0[inside]
+    t = ijk[inside] - i0
+    base = (i0[:, 2] * ny + i0[:, 1]) * nx + i0[:, 0]
+    index = np.empty((8, len(base)), dtype=np.intp)
+    weights = np.empty((8, len(base)))
+    corner = 0
+    for dz in (0, 1):
+        wz = t[:, 2] if dz else 1 - t[:, 2]
+        for dy in (0, 1):
+            wzy = wz * (t[:, 1] if dy else 1 - t[:, 1])
+            for dx in (0, 1):
+                index[corner] = base + ((dz * ny + dy) * nx + dx)
+                weights[corner] = wzy * (t[:, 0] if dx else 1 - t[:, 0])
+                corner += 1
+    grid = np.bincount(index.ravel(), weights=weights.ravel(), minlength=nz * ny * nx)
+    return grid.astype(np.float32).reshape(shape)
+
+
+def fft_search(values, xyz_to_ijk, xyz, angle_step=15.0, radius=50.0, keep=5, threads=1, progress=None, operators=None):
+    # Exhaustive search: for every rotation in rotation_grid(angle_step) (about the atom centre), the atoms are
+    # splatted on the map grid and all shifts (up to radius Angstrom) are scored at once by a real FFT
+    # cross-correlation with the map. The best shift of each rotation goes into a heap of the keep best poses.
+    # Scores are the mean interpolated map value at the atoms, as local_fit. Rotations are spread over threads.
+    # Returns the scores and 3x4 scene transforms of the kept poses, best first.
+    import heapq
+    from scipy import fft
+    values = plain_values(values)
+    shape = values.shape
+    map_spectrum = fft.rfftn(values, workers=threads)
+    xyz = np.asarray(xyz, dtype=np.float64)
+    center, sym_rotations, sym_shifts = symmetry_frame(xyz, operators)
+    offsets = xyz - center
+    n_points = len(xyz) * len(sym_rotations)
+    a, b = np.asarray(xyz_to_ijk, dtype=np.float64)[:, :3], np.asarray(xyz_to_ijk, dtype=np.float64)[:, 3]
+    # Correlation index -> signed voxel shift (x, y, z) -> scene shift, and which shifts are within radius
+    signed = [np.fft.fftfreq(n, 1 / n) for n in shape[::-1]]
+    to_xyz = np.linalg.inv(a)
+    shift2 = np.zeros(shape)
+    for axis in range(3):
+        d = (to_xyz[axis, 0] * signed[0][None, None, :] + to_xyz[axis, 1] * signed[1][None, :, None]
+             + to_xyz[axis, 2] * signed[2][:, None, None])
+        shift2 += d * d
+    outside = shift2 > radius ** 2
+    del shift2
+    rotations = rotation_grid(angle_step)
+
+    def best_shift(rotation):
+        points = symmetry_points(offsets, rotation, sym_rotations, sym_shifts) + center
+        template = splat_trilinear(points @ a.T + b, shape)
+        c = fft.irfftn(map_spectrum * np.conj(fft.rfftn(template)), s=shape)
+        c[outside] = -np.inf
+        best = int(np.argmax(c))
+        return float(c.flat[best]) / n_points, best
+
+    heap = [] # (score, -rotation index, rotation index, correlation index), the lowest score on top
+    batch = max(1, 8 * threads)
+    if threads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        pool = ThreadPoolExecutor(max_workers=threads)
+    for start in range(0, len(rotations), batch):
+        chunk = rotations[start:start + batch]
+        results = pool.map(best_shift, chunk) if threads > 1 else map(best_shift, chunk)
+        for r, (score, best) in enumerate(results, start):
+            entry = (score, -r, r, best)
+            if len(heap) < keep:
+                heapq.heappush(heap, entry)
+            elif entry > heap[0]:
+                heapq.heapreplace(heap, entry)
+        if progress is not None:
+            progress(min(start + batch, len(rotations)), len(rotations))
+    if threads > 1:
+        pool.shutdown()
+    best = sorted(heap, reverse=True)
+    scores = np.array([score for score, order, r, index in best])
+    transforms = []
+    for score, order, r, index in best:
+        k, j, i = np.unravel_index(index, shape)
+        shift = to_xyz @ np.array([signed[0][i], signed[1][j], signed[2][k]])
+        transforms.append(pose_transform(rotations[r], shift, center))
+    return scores, np.array(transforms)
+
+
+def binned_map(values, step, shape):
+    # values (z, y, x, pixel size step in that order) binned 2 times to shape by Fourier cropping, with a Gaussian
+    # low-pass of half the binned pixel size. Sample 0 stays put.
+    import chimerax_fourier as fourier
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), (3,))
+    return fourier.rescale(plain_values(values), step, 2 * step, shape, sigma=step.max())
+
+
+def map_pyramid(values, step, levels):
+    # The map (z, y, x, pixel size step in that order) and copies binned 2, 4... times (binned_map), finest first.
+    # The voxel indices of level l are those of the map divided by 2**l.
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), (3,))
+    pyramid = [plain_values(values)]
+    for level in range(1, levels + 1):
+        shape = tuple(max(2, s // 2 ** level) for s in pyramid[0].shape)
+        pyramid.append(binned_map(pyramid[-1], step * 2 ** (level - 1), shape))
+    return pyramid
+
+
+def fft_levels(shape, max_size=64):
+    # Binning levels that bring the largest map dimension down to max_size for fft_search.
+    levels = 0
+    while max(shape) / 2 ** levels > max_size:
+        levels += 1
+    return levels
+
+
+def multiresolution_search(values, step, xyz_to_ijk, xyz, coarse_xyz, count=50, radius=50.0, seed=None, jobs=1,
+                           levels=2, keep=5, max_steps=100, log=None, pyramid=None, engine='numpy', angle_step=15.0,
+                           threads=1, operators=None, converge=None, progress=None, runner=None):
+    # fit_search (or with engine fft, fft_search then local fits of its best poses) on the map binned 2**levels times
+    # with a reduced set of atoms (coarse_xyz, e.g. CA atoms). Those poses are clustered (cluster_poses) and the best
+    # pose of each of the best keep clusters is refined on each finer level in turn, with all the atoms on the full
+    # map. Returns the scores, transforms and cluster sizes (poses of the coarse search in each) of the distinct
+    # poses left, best first. pyramid (map_pyramid, or gradient stacks of its levels) can be given to reuse it.
+    # converge and progress go to the coarse fit_search. runner (search_runner of the pyramid) keeps the workers and
+    # their maps for several searches; otherwise they are started here for all the levels.
+    if pyramid is None:
+        pyramid = map_pyramid(values, step, levels)
+    own_runner = runner is None
+    if own_runner:
+        runner = search_runner(pyramid, jobs)
+    try:
+        for level in range(levels, -1, -1):
+            level_xyz = xyz if level == 0 else coarse_xyz
+            level_xyz_to_ijk = np.asarray(xyz_to_ijk, dtype=np.float64) / 2 ** level
+            center = symmetry_frame(level_xyz, operators)[0]
+            if level == levels and engine == 'fft':
+                scores, transforms = fft_search(pyramid[level], level_xyz_to_ijk, level_xyz, angle_step=angle_step,
+                                                radius=radius, keep=keep, threads=threads, operators=operators)
+                if log is not None:
+                    log('Level %d (binned %d times, %d atoms): best FFT score %.5g of %d rotations'
+                        % (level, 2 ** level, len(level_xyz), scores[0], len(rotation_grid(angle_step))))
+            if level == levels and engine != 'fft':
+                scores, transforms, order = fit_search(pyramid[level], level_xyz_to_ijk, level_xyz, count=count,
+                                                       radius=radius, seed=seed, jobs=jobs, max_steps=max_steps,
+                                                       operators=operators, converge=converge, log=log,
+                                                       progress=progress, runner=runner, level=level)
+                sizes = np.ones(len(scores), dtype=np.intp)
+            else:
+                if level == levels:
+                    sizes = np.ones(len(scores), dtype=np.intp)
+                rotations, shifts = start_shifts(transforms[:keep], center)
+                scores, transforms, order = fit_poses(pyramid[level], level_xyz_to_ijk, level_xyz, rotations, shifts,
+                                                      jobs=jobs, max_steps=max_steps, operators=operators,
+                                                      runner=runner, level=level)
+                sizes = sizes[:keep][order]
+            labels, counts, heads = cluster_poses(transforms, center)
+            scores, transforms = scores[heads], transforms[heads]
+            sizes = np.bincount(labels, weights=sizes, minlength=len(heads)).astype(np.intp)
+            if log is not None:
+                log('Level %d (binned %d times, %d atoms): best mean map value %.5g, %d distinct of %d poses'
+                    % (level, 2 ** level, len(level_xyz), scores[0], len(heads), len(labels)))
+    finally:
+        if own_runner:
+            runner.close()
+    return scores, transforms, sizes
+
+
+def fit_metrics(values, xyz_to_ijk, step, xyz, level, resolution, operators=None):
+    # How well atoms (scene coordinates) fit a map (z, y, x, pixel size step in x, y, z): the mean interpolated map
+    # value at the atoms, the number of atoms at or above the contour level, and the overlap (sum of products) and
+    # correlation (about zero, as fitmap) of the map with a molmap of the atoms at resolution, over the grid points
+    # where that molmap is above 1% of its maximum. With symmetry operators, all the copies are measured.
+    values = plain_values(values)
+    center, rotations, shifts = symmetry_frame(xyz, operators)
+    xyz = symmetry_points(np.asarray(xyz, dtype=np.float64) - center, np.eye(3), rotations, shifts) + center
+    m = np.asarray(xyz_to_ijk, dtype=np.float64)
+    at_atoms = interpolate(values[None], xyz @ m[:, :3].T + m[:, 3])[0]
+    model = molmap_values(m, xyz, 1.0, values.shape, step, resolution)
+    inside = model >= 0.01 * model.max()
+    u = model[inside].astype(np.float64)
+    v = values[inside].astype(np.float64)
+    overlap = float(np.dot(u, v))
+    norm = np.linalg.norm(u) * np.linalg.norm(v)
+    return {'mean_value': float(at_atoms.mean(dtype=np.float64)),
+            'atoms_inside': int(np.count_nonzero(at_atoms >= level)),
+            'overlap': overlap,
+            'correlation': float(overlap / norm) if norm > 0 else 0.0}
+
+
+def apply_transform(structures, transform):
+    # Move structures by a 3x4 scene coordinate transform.
+    from chimerax.geometry import Place
+    place = Place(matrix=transform)
+    for s in structures:
+        s.scene_position = place * s.scene_position
+
+
+def symmetry_operators(structure):
+    # BIOMT (or mmCIF assembly) operators of structure as scene coordinate 3x4 matrices (n_ops x 3 x 4), or None.
+    from chimerax.atomic.pdbmatrices import biological_unit_matrices
+    places = biological_unit_matrices(structure)
+    if places is None or len(places) == 0:
+        return None
+    p = structure.scene_position
+    return np.array([(p * b * p.inverse()).matrix for b in places])
+
+
+def symmetric_refine(session, atoms, volume, operators, max_steps=500):
+    # Local fit of the whole assembly (atoms plus the symmetry operators) at full resolution, in place of fitmap.
+    import chimerax_map_cache as map_cache # not at the top, chimerax_map_cache imports this module
+    xyz_to_ijk = (volume.data.xyz_to_ijk_transform * volume.scene_position.inverse()).matrix
+    scores, transforms, order = fit_poses(map_cache.map_gradients(session, volume), xyz_to_ijk, atoms.scene_coords, np.eye(3)[None],
+                                          np.zeros((1, 3)), max_steps=max_steps, operators=operators)
+    apply_transform(atoms.unique_structures, transforms[0])
+    session.logger.status('Refined assembly of %d copies: mean map value %.5g' % (len(operators), scores[0]), log=True)
@@ -0,0 +1,205 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Fourier space resampling of maps, one axis at a time with real FFTs (scipy.fft, float32 throughout):
+#  resample_axis   Fourier crop (binning) or pad (upsampling) along one axis, with an optional Gaussian low-pass
+#  cubic_resample_axis   small real space resample for what is left when the pixel size ratio is not exact
+#  rescale         both, on every axis, to a new pixel size and box size (rescale_axis for one axis)
+#  resample_spectrum + crop   the same from a precomputed rfftn, to make many maps from one FFT
+
+import numpy as np
+
+
+def axis_shape(n, axis, ndim):
+    shape = [1] * ndim
+    shape[axis] = n
+    return shape
+
+
+def gaussian_transfer(n, sigma):
+    # Fourier transform of a unit integral Gaussian of sdev sigma pixels, at the rfft frequencies of n samples.
+    f = np.fft.rfftfreq(n)
+    return np.exp(-2 * np.pi ** 2 * sigma ** 2 * f * f).astype(np.float32)
+
+
+def resample_axis(a, n_out, axis=0, sigma=None, band=None, workers=1):
+    # Band limited resampling of a along axis to n_out samples covering the same length (sample 0 stays put).
+    # Values keep their scale. The unpaired Nyquist bin is joined or split as in scipy.signal.resample.
+    # sigma (pixels of a) applies a Gaussian low-pass on the way. band (samples over the same length) cuts
+    # off everything at or above the Nyquist frequency of that sampling, for oversampled output.
+    from scipy import fft
+    a = np.asarray(a, dtype=np.float32)
+    n = a.shape[axis]
+    if n_out == n and not sigma and band is None:
+        return a
+    f = fft.rfft(a, axis=axis, workers=workers)
+    if sigma:
+        f *= gaussian_transfer(n, sigma).reshape(axis_shape(f.shape[axis], axis, a.ndim))
+    m = min(n, n_out)
+    keep = [slice(None)] * a.ndim
+    keep[axis] = slice(0, m // 2 + 1)
+    f = f[tuple(keep)]
+    if band is not None and (band - 1) // 2 < m // 2:
+        cut = [slice(None)] * a.ndim
+        cut[axis] = slice((band - 1) // 2 + 1, None)
+        f[tuple(cut)] = 0
+    elif m % 2 == 0 and n_out != n:
+        nyquist = [slice(None)] * a.ndim
+        nyquist[axis] = m // 2
+        f[tuple(nyquist)] *= 2 if n_out < n else 0.5
+    out = fft.irfft(f, n=n_out, axis=axis, workers=workers)
+    if n_out != n:
+        out *= np.float32(n_out / n)
+    return out.astype(np.float32, copy=False)
+
+
+def cubic_weights(t):
+    # Keys cubic convolution weights (a = -0.5) for offsets -1, 0, 1, 2 from the sample below each position.
+    t2 = t * t
+    t3 = t2 * t
+    return (-0.5 * t3 + t2 - 0.5 * t,
+            1.5 * t3 - 2.5 * t2 + 1,
+            -1.5 * t3 + 2 * t2 + 0.5 * t,
+            0.5 * t3 - 0.5 * t2)
+
+
+def cubic_resample_axis(a, positions, axis=0):
+    # Values of a at fractional sample positions along axis (cubic convolution, exact at whole positions).
+    # Anything beyond the ends of the axis counts as zero, so this also crops and pads.
+    a = np.asarray(a, dtype=np.float32)
+    n = a.shape[axis]
+    positions = np.asarray(positions, dtype=np.float64)
+    shape = axis_shape(len(positions), axis, a.ndim)
+    whole = np.rint(positions)
+    if np.allclose(positions, whole, rtol=0, atol=1e-6): # plain crop/pad/shift
+        index = whole.astype(np.intp)
+        inside = (index >= 0) & (index < n)
+        out = np.take(a, np.clip(index, 0, n - 1), axis=axis)
+        if not inside.all():
+            out *= inside.astype(np.float32).reshape(shape)
+        return out
+    i0 = np.floor(positions).astype(np.intp)
+    out = None
+    for offset, w in zip((-1, 0, 1, 2), cubic_weights(positions - i0)):
+        index = i0 + offset
+        w = (w * ((index >= 0) & (index < n))).astype(np.float32).reshape(shape)
+        term = np.take(a, np.clip(index, 0, n - 1), axis=axis)
+        term *= w
+        if out is None:
+            out = term
+        else:
+            out += term
+    return out
+
+
+def new_sampling(n, step, new_step):
+    # Samples covering the same length at new_step, and the band limit when that is not a whole number.
+    # Then the axis is sampled at least twice as finely (band limited to new_step, and rounded up to a fast
+    # FFT size) for an accurate final cubic step.
+    from scipy import fft
+    samples = n * step / new_step
+    n1 = max(1, int(round(samples)))
+    if abs(samples - n1) > 1e-6 * samples:
+        return fft.next_fast_len(int(np.ceil(2 * samples)), real=True), int(np.floor(samples))
+    return n1, None
+
+
+def final_resample(a, axis, n1, step1, new_step, new_size, start):
+    # Cubic crop/pad/shift to the output samples, skipped when the samples already line up.
+    positions = (start + new_step * np.arange(new_size)) / step1
+    if new_size != n1 or not np.allclose(positions, np.arange(n1), rtol=0, atol=1e-6):
+        a = cubic_resample_axis(a, positions, axis=axis)
+    return a
+
+
+def spectrum_axis_bins(n, n_out, band=None, half=False):
+    # Which bin of an n sample spectrum axis goes in each bin of the n_out sample axis, with weights (zero
+    # outside the band). Follows resample_axis: unpaired Nyquist bins are joined when cropping (the second
+    # bin to add is returned as join = (new bin, old bin)) and split in two when padding. half is the
+    # last axis of an rfftn, where irfftn supplies the negative frequencies.
+    m = min(n, n_out)
+    n_bins = n_out // 2 + 1 if half else n_out
+    old = np.zeros(n_bins, dtype=np.intp)
+    weight = np.zeros(n_bins, dtype=np.float32)
+    freq = np.zeros(n_bins, dtype=np.float64) # signed bin number
+    join = None
+    k = np.arange(m // 2 + 1)
+    old[k], weight[k], freq[k] = k, 1, k
+    if not half:
+        k = np.arange(1, (m - 1) // 2 + 1)
+        old[n_out - k], weight[n_out - k], freq[n_out - k] = n - k, 1, -k
+    if m % 2 == 0 and n_out != n:
+        nyquist = m // 2
+        if half:
+            weight[nyquist] = 2 if n_out < n else 0.5
+        elif n_out < n:
+            join = (nyquist, n - nyquist)
+        else:
+            weight[nyquist] = 0.5
+            old[n_out - nyquist], weight[n_out - nyquist], freq[n_out - nyquist] = nyquist, 0.5, -nyquist
+    if band is not None:
+        weight[np.abs(freq) > (band - 1) // 2] = 0
+    return old, weight, freq, join
+
+
+def resample_spectrum(spectrum, shape, step, new_step, sigma=None, workers=1):
+    # Fourier crop/pad (and low-pass) from spectrum = scipy.fft.rfftn(a) of an array of shape, then a single
+    # (smaller) irfftn. Returns the resampled array, which covers the same box as a, and its pixel size
+    # (new_step, or up to half of it where the ratio is not a whole number of samples, see new_sampling).
+    from scipy import fft
+    ndim = len(shape)
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), (ndim,))
+    new_step = np.broadcast_to(np.asarray(new_step, dtype=np.float64), (ndim,))
+    samplings = [new_sampling(shape[axis], step[axis], new_step[axis]) for axis in range(ndim)]
+    f = spectrum
+    for axis, (n1, band) in enumerate(samplings):
+        n = shape[axis]
+        old, weight, freq, join = spectrum_axis_bins(n, n1, band=band, half=(axis == ndim - 1))
+        if sigma:
+            weight *= np.exp(-2 * np.pi ** 2 * (sigma / step[axis]) ** 2 * (freq / n) ** 2).astype(np.float32)
+        new_f = np.take(f, old, axis=axis)
+        new_f *= weight.reshape(axis_shape(len(weight), axis, ndim))
+        if join is not None:
+            to_bin = [slice(None)] * ndim
+            to_bin[axis] = join[0]
+            new_f[tuple(to_bin)] += np.take(f, join[1], axis=axis) * weight[join[0]]
+        f = new_f
+    new_samples = [n1 for n1, band in samplings]
+    a = fft.irfftn(f, s=new_samples, workers=workers).astype(np.float32, copy=False)
+    a *= np.float32(np.prod(np.array(new_samples, dtype=np.float64) / np.array(shape)))
+    return a, np.array([shape[axis] * step[axis] / n1 for axis, n1 in enumerate(new_samples)])
+
+
+def crop(a, step, new_step, new_shape, start=0.0):
+    # Final cubic step of rescale on every axis: new_shape samples of new_step from start Angstrom.
+    ndim = a.ndim
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), (ndim,))
+    new_step = np.broadcast_to(np.asarray(new_step, dtype=np.float64), (ndim,))
+    start = np.broadcast_to(np.asarray(start, dtype=np.float64), (ndim,))
+    for axis in range(ndim):
+        a = final_resample(a, axis, a.shape[axis], step[axis], new_step[axis], new_shape[axis], start[axis])
+    return a
+
+
+def rescale(a, step, new_step, new_shape, start=0.0, sigma=None, workers=1):
+    # Resample a (pixel size step) to new_shape samples of new_step, where output sample 0 is start Angstrom
+    # from input sample 0. Per axis (all in array axis order): Fourier crop/pad to new_step (with the Gaussian
+    # low-pass sigma Angstrom if given), then a small cubic resample for the start and any pixel size ratio that
+    # is not a whole number of samples. Those axes are Fourier padded to twice the sampling first, which keeps
+    # the cubic step accurate, and the cubic step is skipped altogether when the samples already line up.
+    a = np.asarray(a, dtype=np.float32)
+    ndim = a.ndim
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), (ndim,))
+    new_step = np.broadcast_to(np.asarray(new_step, dtype=np.float64), (ndim,))
+    start = np.broadcast_to(np.asarray(start, dtype=np.float64), (ndim,))
+    for axis in range(ndim):
+        a = rescale_axis(a, axis, step[axis], new_step[axis], new_shape[axis], start=start[axis], sigma=sigma, workers=workers)
+    return a
+
+
+def rescale_axis(a, axis, step, new_step, new_size, start=0.0, sigma=None, workers=1):
+    # One axis of rescale. Each line along axis is independent, so large maps can be done a slab at a time.
+    n = a.shape[axis]
+    n1, band = new_sampling(n, step, new_step)
+    a = resample_axis(a, n1, axis=axis, sigma=sigma / step if sigma else None, band=band, workers=workers)
+    return final_resample(a, axis, n1, n * step / n1, new_step, new_size, start)
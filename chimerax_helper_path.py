@@ -0,0 +1,13 @@
+#Opened first by chimerax_custom_functions.cxc, before the command scripts (not a command itself).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#The command scripts import the helper modules that sit next to them (chimerax_cache, chimerax_fit_search...).
+#ChimeraX does not put the directory of an opened script on sys.path, so this adds it once for all of them.
+#To open a command script on its own, open this file first.
+
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd()
+if script_dir not in sys.path:
+    sys.path.insert(0, script_dir)
@@ -0,0 +1,94 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Per map preprocessing shared by the fitting commands (rough fitmap, rough fitmap batch, fit opposite hand), kept in
+#one session LRU cache with a memory cap and keyed by map identity and data version (chimerax_cache.data_key), so
+#repeated searches, refinements and batch runs against the same map only prepare it once:
+#  map_values      float32 C-contiguous full matrix
+#  map_level       binned, low-pass filtered copy (level l is binned 2**l times, as fit_search.map_pyramid)
+#  map_gradients   values and x, y, z gradients of a level (fit_search.gradient_stack), which replace the cached
+#                  values of that level
+#The cap is MAP_CACHE_BYTES, or more if one map's gradient stacks need it. Anything too big to keep is logged.
+#  map_statistics  mean, SD, RMS, minimum, maximum and the automatic contour level
+
+import numpy as np
+from chimerax_cache import session_cache, data_key, value_nbytes
+from chimerax_centroids import AUTO_LEVEL_FRACTION
+import chimerax_fit_search as fit_search
+
+MAP_CACHE_BYTES = 2**31 # memory allowed for prepared maps per session, raised to fit the largest map in use
+
+
+def pyramid_bytes(volume):
+    # Memory for the gradient stacks of every level of a map (4 float32 channels, each level 1/8 of the last).
+    return int(4 * 4 * np.prod(volume.data.size, dtype=np.float64) * 8 / 7)
+
+
+def map_cache(session, volume):
+    # The session cache, with room for at least one map's gradient stacks (so a 512^3 map is not prepared again
+    # every time it is searched).
+    cache = session_cache(session, 'fitting maps', max_bytes=MAP_CACHE_BYTES)
+    cache.max_bytes = max(MAP_CACHE_BYTES, pyramid_bytes(volume))
+    return cache
+
+
+def cached(session, volume, name, compute):
+    # compute() once per map, data version and name, until evicted.
+    cache = map_cache(session, volume)
+    key = data_key(volume.data) + (name,)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        nbytes = value_nbytes(value)
+        if nbytes > cache.max_bytes:
+            what = name if isinstance(name, str) else '%s %d' % name
+            session.logger.warning('Prepared %s of map #%s (%d MB) is larger than the map cache (%d MB), '
+                                   'so it is not kept.' % (what, volume.id_string, nbytes // 2**20,
+                                                           cache.max_bytes // 2**20))
+        cache.put(key, value, nbytes)
+    return value
+
+
+def map_values(session, volume):
+    return map_level(session, volume, 0)
+
+
+def map_level(session, volume, level):
+    # Values of a level (level 0 is the map itself). Once the level's gradient stack is prepared they are only
+    # kept as its first channel, so the cache does not hold them twice.
+    stack = map_cache(session, volume).get(data_key(volume.data) + (('gradients', level),))
+    if stack is not None:
+        return stack[0]
+    if level == 0:
+        return cached(session, volume, ('level', 0),
+                      lambda: np.ascontiguousarray(volume.full_matrix(), dtype=np.float32))
+
+    def compute():
+        shape = tuple(max(2, s // 2 ** level) for s in map_values(session, volume).shape)
+        step = np.array(volume.data.step[::-1], dtype=np.float64) * 2 ** (level - 1)
+        return fit_search.binned_map(map_level(session, volume, level - 1), step, shape)
+    return cached(session, volume, ('level', level), compute)
+
+
+def map_gradients(session, volume, level=0):
+    def compute():
+        stack = fit_search.gradient_stack(map_level(session, volume, level))
+        map_cache(session, volume).remove(data_key(volume.data) + (('level', level),)) # now in stack[0]
+        return stack
+    return cached(session, volume, ('gradients', level), compute)
+
+
+def map_pyramid(session, volume, levels):
+    # Gradient stacks of levels 0 to levels, for fit_search.multiresolution_search.
+    return [map_gradients(session, volume, level) for level in range(levels + 1)]
+
+
+def map_statistics(session, volume):
+    def compute():
+        values = map_values(session, volume)
+        mean = float(values.mean(dtype=np.float64))
+        rms = float(np.sqrt(np.square(values, dtype=np.float64).mean()))
+        return {'mean': mean, 'sd': float(np.sqrt(max(rms * rms - mean * mean, 0.0))), 'rms': rms,
+                'min': float(values.min()), 'max': float(values.max()),
+                'contour': float(np.quantile(values, 1 - AUTO_LEVEL_FRACTION))}
+    return cached(session, volume, 'statistics', compute)
@@ -7,7 +7,7 @@ def next_lowest_model_id(session):
     lowest_unused_model_id = max([m.id_string for m in session.models])
     return int(float(lowest_unused_model_id))+1
 
-def map_eraser_mask_create(session, mask, sphere, save_masks=True, file_root=None, sphere_append='_sphere', full_append='_plus_sphere', extend=0.0, width=12):
+def map_eraser_mask_create(session, mask, sphere, save_masks=True, file_root=None, sphere_append='_sphere', full_append='_plus_sphere', extend=0.0, width=12, threads=1):
     center = sphere.scene_position.origin()
 
     radius = sphere.radius
@@ -58,13 +58,13 @@ def map_eraser_mask_create(session, mask, sphere, save_masks=True, file_root=Non
     # Soften sphere mask
     cmd = 'soft_edge_mask %s level 0.5 extend %.2f width %.2f' % (sphere_model_id, extend, width)
     print(cmd)
-    soft_sphere = soft_edge_mask(session, sphere_v, level=0.5, extend=extend, width=width)
+    soft_sphere = soft_edge_mask(session, sphere_v, level=0.5, extend=extend, width=width, threads=threads)
     soft_sphere_id = soft_sphere.id_string
 
     # Soften combined mask
     cmd = 'soft_edge_mask %s level 0.5 extend %.2f width %.2f' % (combined_model_id, extend, width)
     print(cmd)
-    soft_combined = soft_edge_mask(session, combined_v, level=0.5, extend=extend, width=width)
+    soft_combined = soft_edge_mask(session, combined_v, level=0.5, extend=extend, width=width, threads=threads)
     soft_combined_id = soft_combined.id_string
 
 
@@ -86,7 +86,7 @@ def map_eraser_mask_create(session, mask, sphere, save_masks=True, file_root=Non
 
 
 def register_command(logger):
-    from chimerax.core.commands import CmdDesc, register, ModelArg, StringArg, BoolArg, FloatArg
+    from chimerax.core.commands import CmdDesc, register, ModelArg, StringArg, BoolArg, FloatArg, IntArg
     from chimerax.map import MapsArg
     desc = CmdDesc(
         required=[],
@@ -97,7 +97,8 @@ def register_command(logger):
                  ('sphere_append', StringArg), #Alternative file endings
                  ('full_append', StringArg), #Alternative file endings
                  ('extend', FloatArg), #Extend initial mask (px)
-                 ('width', FloatArg)], #Width soft edge of mask (px)
+                 ('width', FloatArg), #Width soft edge of mask (px)
+                 ('threads', IntArg)], #Threads for the soft edge distance transforms
         required_arguments=['mask', 'sphere'],
         synopsis='Create a mask from the map eraser sphere.'
     )
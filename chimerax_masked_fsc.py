@@ -0,0 +1,134 @@
+#Commands to add extra functionality to ChimeraX.
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+import numpy as np
+
+
+def fourier_shells(shape):
+    # Shell number of every coefficient of an rfftn of a map of this shape (radius in Fourier pixels of the
+    # smallest box edge, rounded) and the number of shells up to Nyquist.
+    n = min(shape)
+    freqs = [np.fft.fftfreq(s) for s in shape[:-1]] + [np.fft.rfftfreq(shape[-1])]
+    r2 = np.zeros([len(f) for f in freqs], dtype=np.float32)
+    for axis, f in enumerate(freqs):
+        view = [1] * len(shape)
+        view[axis] = len(f)
+        r2 += (f.astype(np.float32) ** 2).reshape(view)
+    np.sqrt(r2, out=r2)
+    r2 *= n
+    shells = np.rint(r2).astype(np.int32)
+    return shells, n // 2 + 1
+
+
+def masked_fsc(half1, half2, mask=None, threads=1):
+    # Fourier shell correlation of two half maps (multiplied by the mask if given).
+    # One real FFT per half map, then the shell sums are all done with bincount.
+    # Returns an array of FSC values for shells 0 (the origin) up to Nyquist.
+    from scipy import fft
+    half1 = np.asarray(half1, dtype=np.float32)
+    half2 = np.asarray(half2, dtype=np.float32)
+    if mask is not None:
+        mask = np.asarray(mask, dtype=np.float32)
+        half1 = half1 * mask
+        half2 = half2 * mask
+    shape_x = half1.shape[-1]
+    f1 = fft.rfftn(half1, workers=threads)
+    del half1
+    f2 = fft.rfftn(half2, workers=threads)
+    del half2
+    nx = 2 * (f1.shape[-1] - 1) + (shape_x % 2)
+    shells, n_shells = fourier_shells(f1.shape[:-1] + (nx,))
+    shells = shells.ravel()
+    # The half transform holds each coefficient once. Count the columns whose conjugates are not stored twice.
+    column_weights = np.full(f1.shape[-1], 2, dtype=np.float32)
+    column_weights[0] = 1
+    if nx % 2 == 0:
+        column_weights[-1] = 1
+
+    def shell_sums(values):
+        values *= column_weights
+        return np.bincount(shells, weights=values.ravel(), minlength=n_shells)[:n_shells]
+    cross = shell_sums((f1 * f2.conj()).real)
+    power1 = shell_sums(f1.real ** 2 + f1.imag ** 2)
+    power2 = shell_sums(f2.real ** 2 + f2.imag ** 2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        fsc = cross / np.sqrt(power1 * power2)
+    return np.nan_to_num(fsc)
+
+
+def fsc_resolution(fsc, box_size, pixel_size, threshold=0.143):
+    # Resolution (Angstrom) where the FSC first drops below threshold, interpolated between shells.
+    # Returns the Nyquist resolution if it never does.
+    below = np.flatnonzero(fsc[1:] < threshold)
+    if len(below) == 0:
+        return 2 * pixel_size
+    s = below[0] + 1
+    if s == 1:
+        shell = 1.0
+    else:
+        shell = (s - 1) + (fsc[s - 1] - threshold) / (fsc[s - 1] - fsc[s])
+    return box_size * pixel_size / shell
+
+
+def mask_statistics(mask, edge_tolerance=1e-3):
+    # Fraction of the box inside the mask (sum of the soft mask values) and the number of soft edge voxels.
+    mask = np.asarray(mask)
+    volume_fraction = float(mask.sum(dtype=np.float64)) / mask.size
+    edge_voxels = int(np.count_nonzero((mask > edge_tolerance) & (mask < 1 - edge_tolerance)))
+    return volume_fraction, edge_voxels
+
+
+def masked_fsc_command(session, half_maps, mask=None, threshold=0.143, threads=1, save=None):
+    from chimerax.core.errors import UserError
+    if len(half_maps) != 2:
+        raise UserError("Give exactly two half maps (e.g. masked fsc #1,2 mask #3), got %d." % len(half_maps))
+    half1, half2 = half_maps
+    maps = [half1, half2] + ([mask] if mask is not None else [])
+    if len(set(tuple(v.data.size) for v in maps)) > 1:
+        raise UserError("Half maps and mask must have the same grid size: %s"
+                        % ', '.join('#%s %s' % (v.id_string, 'x'.join(str(s) for s in v.data.size)) for v in maps))
+
+    pixel_size = half1.data.step[0]
+    box_size = min(half1.data.size)
+    m = mask.data.matrix() if mask is not None else None
+    fsc = masked_fsc(half1.data.matrix(), half2.data.matrix(), m, threads=threads)
+    shells = np.arange(len(fsc))
+    with np.errstate(divide='ignore'):
+        resolutions = box_size * pixel_size / shells
+    resolution = fsc_resolution(fsc, box_size, pixel_size, threshold)
+
+    lines = ['%8s %10s %8s' % ('shell', 'res (A)', 'FSC')]
+    lines += ['%8d %10.2f %8.4f' % (s, r, f) for s, r, f in zip(shells[1:], resolutions[1:], fsc[1:])]
+    session.logger.info('\n'.join(lines))
+    label = 'Masked FSC' if mask is not None else 'Unmasked FSC'
+    session.logger.status('%s #%s, #%s: %.2f A at FSC=%.3f' % (label, half1.id_string, half2.id_string, resolution, threshold), log=True)
+    if mask is not None:
+        volume_fraction, edge_voxels = mask_statistics(m)
+        session.logger.status('Mask #%s: volume fraction %.4f (%.1f%% of the box), %d soft edge voxels'
+                              % (mask.id_string, volume_fraction, 100 * volume_fraction, edge_voxels), log=True)
+    if save is not None:
+        with open(save, 'w') as f:
+            f.write('shell,resolution,fsc\n')
+            for s, r, v in zip(shells[1:], resolutions[1:], fsc[1:]):
+                f.write('%d,%.4f,%.6f\n' % (s, r, v))
+        session.logger.status('FSC curve written to %s' % save, log=True)
+    return resolution, fsc
+
+
+def register_command(logger):
+    from chimerax.core.commands import CmdDesc, register, FloatArg, IntArg, SaveFileNameArg
+    from chimerax.map import MapsArg, MapArg
+
+    desc = CmdDesc(
+        required=[('half_maps', MapsArg)], #Two half maps
+        keyword=[('mask', MapArg), #Soft mask applied to both half maps (same grid)
+                 ('threshold', FloatArg), #Default 0.143
+                 ('threads', IntArg), #FFT threads. Default 1.
+                 ('save', SaveFileNameArg)], #Write the curve as CSV
+        required_arguments=['half_maps'],
+        synopsis='Masked half map FSC and mask statistics.')
+    register('masked fsc', desc, masked_fsc_command, logger=logger)
+
+
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
@@ -0,0 +1,86 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#molmap without ChimeraX, for the commands that need simulated maps from atoms on their own grids:
+#  gaussian_splat   sum of separable Gaussians on a float32 grid, optionally over threads
+#  molmap_values    the same normalized as molmap, at atom coordinates mapped onto a grid
+
+import numpy as np
+
+SIGMA_FACTOR = 1 / (np.pi * np.sqrt(2)) # molmap default, sdev = 0.225 x resolution
+CUTOFF_RANGE = 5.0 # molmap default, Gaussians are cut off at 5 sdevs along each axis
+
+
+def gaussian_window(centers, sdev, reach, window, lo, hi):
+    # 1-D Gaussian weights along one axis for a batch of atoms: voxels lo + 0..window-1 from each atom's first
+    # voxel, zero outside [lo_limit, hi_limit] (the cutoff and the grid/slab edges). Returns (indices, weights).
+    start = np.ceil(centers - reach)
+    idx = start[:, None] + np.arange(window)
+    inside = (idx <= np.floor(centers + reach)[:, None]) & (idx >= lo) & (idx < hi)
+    d = ((idx - centers[:, None]) / sdev).astype(np.float32)
+    g = np.exp(-0.5 * d * d)
+    g *= inside
+    return np.clip(idx, lo, hi - 1).astype(np.intp), g
+
+
+def gaussian_splat(ijk, weights, shape, sdev, cutoff_range=CUTOFF_RANGE, threads=1, batch_voxels=2**22):
+    # Sum of Gaussians (peak height weight, sdev pixels along i, j, k) on a float32 grid of shape (k, j, i).
+    # Same sums as molmap's sum_of_gaussians: each atom only adds into the voxels within cutoff_range sdevs along
+    # each axis. The Gaussian is separable, so each batch of atoms gets 1-D weights along each axis and their
+    # outer products are accumulated with np.add.at. With threads, the grid is split into k slabs and each
+    # thread adds the atoms that reach its slab.
+    grid = np.zeros(shape, dtype=np.float32)
+    ijk = np.asarray(ijk, dtype=np.float64).reshape(-1, 3)
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float32), (len(ijk),))
+    sdev = np.broadcast_to(np.asarray(sdev, dtype=np.float64), (3,))
+    reach = cutoff_range * sdev
+    window = (np.floor(2 * reach) + 1).astype(int)
+    size = np.array(shape[::-1]) # i, j, k
+    keep = np.all((np.floor(ijk + reach) >= 0) & (np.ceil(ijk - reach) <= size - 1), axis=1) & (weights != 0)
+    ijk, weights = ijk[keep], weights[keep]
+    order = np.argsort(ijk[:, 2], kind='stable') # nearby atoms together, so np.add.at touches memory in order
+    ijk, weights = ijk[order], weights[order]
+    batch = max(1, batch_voxels // int(np.prod(window)))
+    flat = grid.reshape(-1)
+    plane = shape[1] * shape[2]
+    index_type = np.int32 if grid.size < 2**31 else np.int64
+
+    def splat_slab(k0, k1):
+        first = np.searchsorted(ijk[:, 2], k0 - reach[2], side='left')
+        last = np.searchsorted(ijk[:, 2], k1 - 1 + reach[2], side='right')
+        for b in range(first, last, batch):
+            c = ijk[b:min(b + batch, last)]
+            ii, gi = gaussian_window(c[:, 0], sdev[0], reach[0], window[0], 0, shape[2])
+            jj, gj = gaussian_window(c[:, 1], sdev[1], reach[1], window[1], 0, shape[1])
+            kk, gk = gaussian_window(c[:, 2], sdev[2], reach[2], window[2], k0, k1)
+            gk *= weights[b:b + len(c), None]
+            # k, j products first so only one operation each is over the full windows
+            gkj = gk[:, :, None] * gj[:, None, :]
+            values = gkj[:, :, :, None] * gi[:, None, None, :]
+            kj = (kk * plane).astype(index_type)[:, :, None] + (jj * shape[2]).astype(index_type)[:, None, :]
+            index = kj[:, :, :, None] + ii.astype(index_type)[:, None, None, :]
+            np.add.at(flat, index.reshape(-1), values.reshape(-1))
+
+    if len(ijk) == 0:
+        return grid
+    if threads > 1 and shape[0] > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        edges = np.linspace(0, shape[0], min(threads, shape[0]) + 1).astype(int)
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(lambda s: splat_slab(edges[s], edges[s + 1]), range(len(edges) - 1)))
+    else:
+        splat_slab(0, shape[0])
+    return grid
+
+
+def molmap_values(xyz_to_ijk, xyz, weights, shape, step, resolution, sigma_factor=SIGMA_FACTOR,
+                  cutoff_range=CUTOFF_RANGE, threads=1):
+    # molmap on an existing grid without ChimeraX: xyz (grid coordinates, Angstrom) are mapped to indices with
+    # the 3x4 xyz_to_ijk matrix, and the sum is normalized as molmap does (Gaussians of unit integral x weight).
+    m = np.asarray(xyz_to_ijk, dtype=np.float64)
+    ijk = np.asarray(xyz, dtype=np.float64) @ m[:, :3].T + m[:, 3]
+    sdev = sigma_factor * resolution
+    grid = gaussian_splat(ijk, weights, shape, sdev / np.asarray(step, dtype=np.float64), cutoff_range=cutoff_range,
+                          threads=threads)
+    grid *= np.float32(pow(2 * np.pi, -1.5) * pow(sdev, -3))
+    return grid
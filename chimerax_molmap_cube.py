@@ -3,37 +3,147 @@
 
 import os
 import numpy as np
+import chimerax_fourier as fourier
+import chimerax_mrc_io as mrc_io
+from chimerax_centroids import define_centroid
+from chimerax_orientations import fibonacci_directions
+from chimerax_molmap import SIGMA_FACTOR, molmap_values
 
-def define_centroid(session, atoms, mass_weighting=False): # from cmd_centroid
-    from chimerax.core.errors import UserError
-    from chimerax.centroids import centroid
-    from chimerax.atomic import AtomicStructure, concatenate
-    if atoms is None:
-        structures_atoms = [m.atoms for m in session.models if isinstance(m, AtomicStructure)]
-        if structures_atoms:
-            atoms = concatenate(structures_atoms)
-    if not atoms:
-        raise UserError("Atom specifier selects no atoms")
+
+def molmap_series(xyz, weights, center, resolutions, sizes, spacings, threads=1):
+    # Every combination of resolution, box size and spacing from one molmap at the finest resolution and spacing,
+    # centred on center. Gaussians add their variances, so each coarser resolution is a Gaussian low-pass of the
+    # fine map. The fine map is Fourier transformed once, and each map is low-pass filtered and cropped/padded to
+    # its spacing from that spectrum (chimerax_fourier.resample_spectrum and crop).
+    # Yields (resolution, size, spacing, values, origin). The fine map needs a spacing of about resolution / 3
+    # or less to be free of aliasing.
+    resolution0 = min(resolutions)
+    spacing0 = min(spacings)
+    sdev0 = SIGMA_FACTOR * resolution0
+    filter_sdevs = [np.sqrt(max((SIGMA_FACTOR * r) ** 2 - sdev0 ** 2, 0)) for r in resolutions]
+    # Room around the biggest box for the low-pass tails, so wrap around in the FFTs stays outside every box
+    extent = max(n * s for n in sizes for s in spacings) + 2 * (3 * max(filter_sdevs) + 2 * max(spacings))
+    n0 = int(np.ceil(extent / spacing0))
+    while not is_fft_friendly(n0):
+        n0 += 1
+    origin0 = np.asarray(center, dtype=np.float64) - n0 / 2.0 * spacing0
+    xyz_to_ijk = np.hstack([np.eye(3) / spacing0, -origin0[:, None] / spacing0])
+    values = molmap_values(xyz_to_ijk, xyz, weights, (n0, n0, n0), (spacing0,) * 3, resolution0, threads=threads)
+    from scipy import fft
+    spectrum = fft.rfftn(values, workers=threads)
+    del values
+    for resolution, filter_sdev in zip(resolutions, filter_sdevs):
+        for spacing in spacings:
+            # Every box size at this resolution and spacing is cut from the same resampled map
+            resampled, step1 = fourier.resample_spectrum(spectrum, (n0, n0, n0), spacing0, spacing, workers=threads,
+                                                         sigma=filter_sdev if filter_sdev > 0 else None)
+            for size in sizes:
+                start = n0 / 2.0 * spacing0 - size / 2.0 * spacing
+                out = fourier.crop(resampled, step1, spacing, (size, size, size), start=start)
+                yield resolution, size, spacing, out, origin0 + start
+
+
+FFT_PRIMES = (2, 3, 5, 7) # box sizes with only these prime factors have fast FFTs (RELION, cryoSPARC, FFTW)
+
+
+def prime_factors(n):
+    factors = []
+    p = 2
+    while p * p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+def is_fft_friendly(n):
+    return n > 0 and n % 2 == 0 and all(p in FFT_PRIMES for p in prime_factors(n))
+
+
+def model_diameter(xyz, max_hull_points=4000):
+    # Largest distance between any two atoms. Only the convex hull vertices need checking. Falls back to the
+    # bounding sphere diameter when there is no 3D hull (fewer than 4 atoms, or all in a plane). Very round
+    # hulls use the widest extent over 2000 directions instead of all vertex pairs (at most 0.4% too small).
+    xyz = np.asarray(xyz, dtype=np.float64)
+    if len(xyz) < 2:
+        return 0.0
+    try:
+        from scipy.spatial import ConvexHull
+        points = xyz[ConvexHull(xyz).vertices]
+    except Exception:
+        center = 0.5 * (xyz.min(axis=0) + xyz.max(axis=0))
+        return 2 * float(np.sqrt(((xyz - center) ** 2).sum(axis=1).max()))
+    if len(points) > max_hull_points:
+        projections = points @ fibonacci_directions(2000).T
+        return float((projections.max(axis=0) - projections.min(axis=0)).max())
+    diameter2 = 0.0
+    for start in range(0, len(points), 1024): # blocks of the pairwise distance matrix
+        d2 = ((points[start:start + 1024, None, :] - points[None, :, :]) ** 2).sum(axis=2)
+        diameter2 = max(diameter2, float(d2.max()))
+    return float(np.sqrt(diameter2))
+
+
+def box_size_candidates(diameter, spacing, padding=1.5, count=8):
+    # FFT friendly box sizes near diameter x padding, ranked: big enough sizes first (smallest first), then
+    # the ones just below. Returns a list of (size, box in Angstrom, padding achieved).
+    target = max(int(np.ceil(diameter * padding / spacing)), 2)
+    above = []
+    n = target
+    while len(above) < count:
+        if is_fft_friendly(n):
+            above.append(n)
+        n += 1
+    below = [n for n in range(target - 1, max(target // 2, 1), -1) if is_fft_friendly(n)][:max(count // 4, 1)]
+    sizes = above + below
+    return [(n, n * spacing, n * spacing / diameter if diameter > 0 else float('inf')) for n in sizes]
+
+
+def auto_box_size(session, atoms, spacing, padding=1.5, table=False):
+    # Pick the smallest FFT friendly box that fits the model with the requested padding (logged as a table if asked).
+    diameter = model_diameter(atoms.scene_coords)
+    candidates = box_size_candidates(diameter, spacing, padding)
+    size = candidates[0][0]
+    session.logger.status('Model diameter %.1f angstrom, %.1f pixels at %.2f angstrom/pixel. Box of %d pixels (padding %.2f).'
+                          % (diameter, diameter / spacing, spacing, size, candidates[0][2]), log=True)
+    if table:
+        lines = ['%4s %6s %9s %8s  %s' % ('rank', 'size', 'box (A)', 'padding', 'factors')]
+        for rank, (n, box, pad) in enumerate(candidates, 1):
+            lines.append('%4d %6d %9.1f %8.2f  %s' % (rank, n, box, pad, 'x'.join(str(p) for p in prime_factors(n))))
+        session.logger.info('\n'.join(lines))
+    return size
+
+
+def molmap_on_grid(session, atoms, resolution, grid, threads=1):
+    # Same as molmap(session, atoms, resolution, on_grid=grid) but with the numpy splatting above.
+    from chimerax.map_data import ArrayGridData
+    from chimerax.map import volume_from_grid_data
+    data = grid.data
+    xyz = grid.scene_position.inverse().transform_points(atoms.scene_coords)
+    values = molmap_values(data.xyz_to_ijk_transform.matrix, xyz, atoms.element_numbers, tuple(data.size[::-1]),
+                           data.step, resolution, threads=threads)
     structures = atoms.unique_structures
-    if len(structures) > 1:
-        crds = atoms.scene_coords
-    else:
-        crds = atoms.coords
-    if mass_weighting:
-        masses = atoms.elements.masses
-        avg_mass = masses.sum() / len(masses)
-        import numpy
-        weights = masses[:, numpy.newaxis] / avg_mass
-    else:
-        weights = None
-    xyz = centroid(crds, weights=weights)
-    return xyz
+    name = '%s map %.3g' % (structures[0].name if len(structures) == 1 else 'molmap', resolution)
+    new_grid = ArrayGridData(values, origin=data.origin, step=data.step, cell_angles=data.cell_angles,
+                             rotation=data.rotation, name=name)
+    v = volume_from_grid_data(new_grid, session)
+    v.scene_position = grid.scene_position
+    v.initialize_thresholds(mfrac=(0.95, 1), replace=True)
+    v.show()
+    return v
 
-def molmap_cube(session, atoms, resolution, size, spacing):
+def molmap_cube(session, atoms, resolution, size, spacing, engine='molmap', threads=1, padding=1.5, table=False):
     from chimerax.core.commands import run
     from chimerax.map import molmap
     from chimerax.map_filter.vopcommand import volume_new
 
+    if size == 'auto':
+        size = auto_box_size(session, atoms, spacing, padding=padding, table=table)
+        if table:
+            return # only list the sizes
+
 
 
 
@@ -67,15 +177,56 @@ def molmap_cube(session, atoms, resolution, size, spacing):
     print(cmd)
     run(session, cmd)
 
-    session.logger.status('Running molmap with onGrid option...', log=True)
-    molmap.molmap(session, atoms, resolution, on_grid=box)
+    if engine == 'molmap':
+        session.logger.status('Running molmap with onGrid option...', log=True)
+        molmap.molmap(session, atoms, resolution, on_grid=box)
+    else:
+        session.logger.status('Adding Gaussians for %d atoms to the box...' % len(atoms), log=True)
+        molmap_on_grid(session, atoms, resolution, box, threads=threads)
     session.logger.status('Done.', log=True)
     session.logger.status('Box displayed is %d pixels with a spacing of %.2f angstrom/pixel' % (size, spacing), log=True)
 
 
+def molmap_cube_series(session, atoms, resolutions, sizes, spacings, threads=1, save_root=None):
+    # molmap cube for every combination of resolutions, sizes and spacings, centred on the atoms (see molmap_series).
+    from chimerax.map_data import ArrayGridData
+    from chimerax.map import volume_from_grid_data
+    from chimerax.core.commands import run
+    from chimerax.core.errors import UserError
+    if len(atoms) == 0:
+        raise UserError("Atom specifier selects no atoms")
+    xyz = atoms.scene_coords
+    center = define_centroid(session, atoms)
+    count = len(resolutions) * len(sizes) * len(spacings)
+    session.logger.status('Making %d molmap cubes from one %.3g angstrom map at %.3g angstrom/pixel...'
+                          % (count, min(resolutions), min(spacings)), log=True)
+    structures = atoms.unique_structures
+    base_name = structures[0].name if len(structures) == 1 else 'molmap'
+    volumes = []
+    paths = []
+    for resolution, size, spacing, values, origin in molmap_series(xyz, atoms.element_numbers, center, resolutions,
+                                                                   sizes, spacings, threads=threads):
+        name = '%s map %.3g %dpx %.3gA' % (base_name, resolution, size, spacing)
+        if save_root is not None:
+            path = '%s_res%g_box%d_apix%g.mrc' % (save_root, resolution, size, spacing)
+            mrc_io.write_mrc(path, values, voxel_size=spacing, origin=origin)
+            paths.append(path)
+        else:
+            grid = ArrayGridData(values, origin=origin, step=(spacing, spacing, spacing), name=name)
+            v = volume_from_grid_data(grid, session, open_model=False)
+            v.initialize_thresholds(mfrac=(0.95, 1), replace=True)
+            volumes.append(v)
+        session.logger.status('Molmap cube: %s' % name, log=True)
+    if save_root is not None:
+        session.logger.status('Written %d maps: %s' % (len(paths), ' '.join(paths)), log=True)
+        series = len(sizes) == 1 and len(spacings) == 1 # a volume series needs the same grid for every map
+        run(session, 'open %s format mrc%s' % (' '.join('"%s"' % p for p in paths), ' vseries true' if series else ''))
+    else:
+        session.models.add_group(volumes, name='%s molmap cube series' % base_name)
+
 
 def register_command(logger):
-    from chimerax.core.commands import CmdDesc, register, ModelArg, FloatArg, IntArg, StringArg, BoolArg
+    from chimerax.core.commands import CmdDesc, register, ModelArg, FloatArg, FloatsArg, IntArg, IntsArg, StringArg, BoolArg, EnumOf, Or, SaveFileNameArg
     from chimerax.map import MapsArg
     from chimerax.atomic import AtomsArg
     from chimerax.map import molmap
@@ -85,12 +236,27 @@ def register_command(logger):
     desc = CmdDesc(
         required=[('atoms', AtomsArg),
                   ('resolution', FloatArg), #Angstrom
-                  ('size', IntArg), #Size of box in pixels
+                  ('size', Or(IntArg, EnumOf(('auto',)))), #Size of box in pixels, or auto to fit the model
                   ('spacing', FloatArg)], #Angstrom per pixel
-        keyword=[],
+        keyword=[('engine', EnumOf(('molmap', 'numpy'))), #The ChimeraX molmap command (default) or numpy
+                 ('threads', IntArg), #Threads for the numpy engine. Default 1.
+                 ('padding', FloatArg), #size auto: box edge / model diameter. Default 1.5
+                 ('table', BoolArg)], #size auto: only list the candidate box sizes
         required_arguments=['atoms', 'resolution', 'size', 'spacing'],
         synopsis='Molmap with a cubic outer shape of a given size and spacing.')
     register('molmap cube', desc, molmap_cube, logger=logger)
 
+    desc = CmdDesc(
+        required=[('atoms', AtomsArg)],
+        keyword=[('resolutions', FloatsArg), #Comma separated lists, e.g. resolutions 4,6,8 sizes 256,128 spacings 1.06,2.12
+                 ('sizes', IntsArg),
+                 ('spacings', FloatsArg),
+                 ('threads', IntArg), #Threads for the molmap and the FFTs. Default 1.
+                 ('save_root', SaveFileNameArg)], #Save as <save_root>_res<r>_box<n>_apix<s>.mrc and open them
+        required_arguments=['resolutions', 'sizes', 'spacings'],
+        synopsis='Molmap cubes at several resolutions, box sizes and spacings from one molmap.')
+    register('molmap cube series', desc, molmap_cube_series, logger=logger)
+
 
-register_command(session.logger)
\ No newline at end of file
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
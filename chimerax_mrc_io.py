@@ -0,0 +1,142 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Minimal MRC/CCP4 reading and writing with numpy memory maps. Needs nothing from ChimeraX so it can be
+#used in headless scripts and worker processes.
+
+import numpy as np
+
+HEADER_DTYPE = np.dtype([
+    ('nx', '<i4'), ('ny', '<i4'), ('nz', '<i4'),
+    ('mode', '<i4'),
+    ('nxstart', '<i4'), ('nystart', '<i4'), ('nzstart', '<i4'),
+    ('mx', '<i4'), ('my', '<i4'), ('mz', '<i4'),
+    ('cella', '<f4', 3),
+    ('cellb', '<f4', 3),
+    ('mapc', '<i4'), ('mapr', '<i4'), ('maps', '<i4'),
+    ('dmin', '<f4'), ('dmax', '<f4'), ('dmean', '<f4'),
+    ('ispg', '<i4'),
+    ('nsymbt', '<i4'),
+    ('extra', 'V100'),
+    ('origin', '<f4', 3),
+    ('map', 'S4'),
+    ('machst', 'u1', 4),
+    ('rms', '<f4'),
+    ('nlabl', '<i4'),
+    ('label', 'S80', 10),
+])
+
+MODE_DTYPES = {0: np.int8, 1: np.int16, 2: np.float32, 6: np.uint16, 12: np.float16}
+
+
+def read_header(path):
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    if header['mode'] not in MODE_DTYPES:
+        raise ValueError("Unsupported MRC mode %d (or big endian file) in %s" % (header['mode'], path))
+    return header
+
+
+def data_offset(header):
+    return HEADER_DTYPE.itemsize + int(header['nsymbt'])
+
+
+def open_data(path, mode='r'):
+    # Returns (header, memory mapped array) with the array in file order (sections, rows, columns).
+    header = read_header(path)
+    shape = (int(header['nz']), int(header['ny']), int(header['nx']))
+    data = np.memmap(path, dtype=MODE_DTYPES[int(header['mode'])], mode=mode, offset=data_offset(header), shape=shape)
+    return header, data
+
+
+def header_voxel_size(header):
+    # Angstrom per pixel along x, y, z
+    m = np.array([header['mx'], header['my'], header['mz']], dtype=float)
+    m[m == 0] = 1
+    return np.array(header['cella'], dtype=float) / m
+
+
+def new_header(shape, voxel_size=None, origin=None, like=None, stack=False):
+    # Header for a float32 map with shape (nz, ny, nx). Anything not given is copied from like.
+    # stack makes an image stack (MRCS) header: nz images of ny x nx, with space group 0 and mz 1.
+    if like is not None:
+        header = np.array(like, dtype=HEADER_DTYPE).copy()
+        if voxel_size is None:
+            voxel_size = header_voxel_size(like)
+    else:
+        header = np.zeros((), dtype=HEADER_DTYPE)
+        header['cellb'] = 90.0
+        header['mapc'], header['mapr'], header['maps'] = 1, 2, 3
+        if voxel_size is None:
+            voxel_size = 1.0
+    if origin is not None:
+        header['origin'] = origin
+        header['nxstart'], header['nystart'], header['nzstart'] = 0, 0, 0
+    nz, ny, nx = shape
+    vs = np.broadcast_to(np.asarray(voxel_size, dtype=float), (3,))
+    header['nx'], header['ny'], header['nz'] = nx, ny, nz
+    header['mx'], header['my'], header['mz'] = nx, ny, nz
+    header['cella'] = vs * np.array([nx, ny, nz])
+    if stack:
+        header['ispg'] = 0
+        header['mz'] = 1
+        header['cella'][2] = vs[2]
+    header['mode'] = 2
+    header['nsymbt'] = 0
+    header['map'] = b'MAP '
+    header['machst'] = (0x44, 0x44, 0, 0)
+    return header
+
+
+def create(path, header, shape=None):
+    # Write a header and return a writable float32 memory map for the data.
+    header = np.array(header, dtype=HEADER_DTYPE)
+    if shape is None:
+        shape = (int(header['nz']), int(header['ny']), int(header['nx']))
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.truncate(HEADER_DTYPE.itemsize + int(np.prod(shape)) * 4)
+    return np.memmap(path, dtype=np.float32, mode='r+', offset=HEADER_DTYPE.itemsize, shape=tuple(shape))
+
+
+def update_statistics(path, data, chunk=16):
+    # Fill in dmin, dmax, dmean and rms, reading the data a few sections at a time.
+    dmin, dmax, total, total_sq = np.inf, -np.inf, 0.0, 0.0
+    for z in range(0, data.shape[0], chunk):
+        block = np.asarray(data[z:z + chunk], dtype=np.float64)
+        dmin = min(dmin, block.min())
+        dmax = max(dmax, block.max())
+        total += block.sum()
+        total_sq += (block * block).sum()
+    n = data.size
+    mean = total / n
+    rms = np.sqrt(max(total_sq / n - mean * mean, 0.0))
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+    header['dmin'], header['dmax'], header['dmean'], header['rms'] = dmin, dmax, mean, rms
+    with open(path, 'r+b') as f:
+        f.write(np.array(header, dtype=HEADER_DTYPE).tobytes())
+
+
+def write_mrc(path, array, voxel_size=None, origin=None, like=None):
+    # Write a whole array (nz, ny, nx) as a float32 MRC file.
+    array = np.asarray(array)
+    data = create(path, new_header(array.shape, voxel_size, origin, like=like), array.shape)
+    data[:] = array
+    data.flush()
+    update_statistics(path, data)
+    del data
+
+
+def read_mrc(path):
+    # Returns (float32 array, voxel size, origin in Angstrom).
+    header, data = open_data(path)
+    vs = header_voxel_size(header)
+    return np.array(data, dtype=np.float32), vs, origin_angstrom(header)
+
+
+def origin_angstrom(header):
+    # MRC2014 origin field if set, otherwise the n*start grid index scaled by the voxel size.
+    origin = np.array(header['origin'], dtype=float)
+    if np.any(origin != 0):
+        return origin
+    start = np.array([header['nxstart'], header['nystart'], header['nzstart']], dtype=float)
+    return start * header_voxel_size(header)
@@ -0,0 +1,46 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Sets of directions and orientations, shared by the commands that sample them:
+#  fibonacci_directions   roughly uniform unit vectors over the sphere
+#  projection_angles      RELION (rot, tilt, psi) angles over those directions, with optional in-plane steps
+#  euler_matrices         rotation matrices for RELION angles
+
+import numpy as np
+
+
+def fibonacci_directions(count):
+    # Roughly uniform unit vectors over the sphere.
+    i = np.arange(count) + 0.5
+    z = 1 - 2 * i / count
+    r = np.sqrt(1 - z * z)
+    phi = np.pi * (1 + np.sqrt(5)) * i
+    return np.stack([r * np.cos(phi), r * np.sin(phi), z], axis=1)
+
+
+def euler_matrices(angles):
+    # RELION rot, tilt, psi (degrees, ZYZ) to rotation matrices, one per row of angles.
+    rot, tilt, psi = np.radians(np.asarray(angles, dtype=np.float64).reshape(-1, 3)).T
+    ca, sa, cb, sb, cg, sg = np.cos(rot), np.sin(rot), np.cos(tilt), np.sin(tilt), np.cos(psi), np.sin(psi)
+    cc, cs, sc, ss = cb * ca, cb * sa, sb * ca, sb * sa
+    m = np.empty((len(rot), 3, 3))
+    m[:, 0] = np.stack([cg * cc - sg * sa, cg * cs + sg * ca, -cg * sb], axis=1)
+    m[:, 1] = np.stack([-sg * cc - cg * sa, -sg * cs + cg * ca, sg * sb], axis=1)
+    m[:, 2] = np.stack([sc, ss, cb], axis=1)
+    return m
+
+
+def projection_angles(count=None, step=None, psi_step=0):
+    # Roughly uniform projection directions over the sphere (count of them, or about step degrees apart),
+    # each with in-plane rotations every psi_step degrees if given. Returns (rot, tilt, psi) rows in degrees.
+    if count is None:
+        count = max(1, int(round(4 * np.pi / np.radians(step) ** 2)))
+    d = fibonacci_directions(count)
+    rot = np.degrees(np.arctan2(d[:, 1], d[:, 0]))
+    tilt = np.degrees(np.arccos(np.clip(d[:, 2], -1, 1)))
+    psis = np.arange(0, 360, psi_step) if psi_step else np.zeros(1)
+    angles = np.empty((count, len(psis), 3))
+    angles[:, :, 0] = rot[:, None]
+    angles[:, :, 1] = tilt[:, None]
+    angles[:, :, 2] = psis[None, :]
+    return angles.reshape(-1, 3)
@@ -0,0 +1,118 @@
+#Helper module for the commands in this repository (not a command itself, so not opened at startup).
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+#Run independent jobs in worker processes. Functions handed to the workers must be importable by name,
+#so they have to come from a module (e.g. "import chimerax_soft_edge_mask"), not from a script opened in ChimeraX.
+
+import os
+import sys
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+WORKER_PYTHON_VARIABLE = 'CHIMERAX_WORKER_PYTHON' # environment variable naming the python for worker processes
+START_TIMEOUT = 120 # seconds allowed for the workers to start (and run the initializer) before running serially
+
+
+def python_executable():
+    # Inside ChimeraX sys.executable can be the ChimeraX application itself. Workers need a plain python
+    # (ChimeraX ships one next to it) so they start headless. The environment variable overrides the guess.
+    exe = os.environ.get(WORKER_PYTHON_VARIABLE)
+    if exe:
+        return exe
+    exe = sys.executable
+    if os.path.basename(exe).lower().startswith('python'):
+        return exe
+    exe_dir = os.path.dirname(exe)
+    for bin_dir in (exe_dir, os.path.join(exe_dir, '..', 'bin'), os.path.join(exe_dir, 'bin')):
+        candidates = sorted(glob.glob(os.path.join(bin_dir, 'python3*')))
+        candidates = [c for c in candidates if os.path.isfile(c) and not c.endswith('-config')]
+        if candidates:
+            return os.path.abspath(candidates[0])
+    return exe
+
+
+def process_pool(jobs, initializer=None, initargs=()):
+    context = multiprocessing.get_context('spawn') # fork is unsafe in a GUI process with threads
+    context.set_executable(python_executable())
+    return ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=initializer, initargs=initargs)
+
+
+def start_pool(jobs, initializer=None, initargs=(), log=print):
+    # process_pool, checked by running a trivial task, or None (after logging why) if the workers do not start,
+    # e.g. when the python found for them is the wrong one. The caller then runs the tasks in this process.
+    pool = None
+    try:
+        pool = process_pool(jobs, initializer, initargs)
+        pool.submit(os.getpid).result(timeout=START_TIMEOUT)
+        return pool
+    except Exception as e:
+        if pool is not None:
+            for process in list(getattr(pool, '_processes', {}).values()):
+                process.terminate() # a hung start never finishes by itself
+            pool.shutdown(wait=False, cancel_futures=True)
+        log('Worker processes did not start with %s (%s: %s). Running in this process instead. Set the %s '
+            'environment variable to the python to use for workers.'
+            % (python_executable(), type(e).__name__, e, WORKER_PYTHON_VARIABLE))
+        return None
+
+
+class TaskRunner:
+    # Worker processes (or this process, for jobs <= 1) that run several rounds of tasks, so initializer(*initargs)
+    # runs once per worker for all of them. Use in a with statement, or call close. When running serially,
+    # finalizer() is called on close to release what the initializer kept in this process. If the workers do not
+    # start (see start_pool) the tasks run serially, after a message to log.
+    def __init__(self, jobs=1, initializer=None, initargs=(), finalizer=None, log=print):
+        self.pool = None
+        self.finalizer = finalizer
+        if jobs > 1:
+            self.pool = start_pool(jobs, initializer, initargs, log=log)
+        if self.pool is None and initializer is not None:
+            initializer(*initargs)
+
+    def run(self, tasks, progress=None):
+        # As run_tasks, with these workers.
+        results = [None] * len(tasks)
+        if self.pool is None:
+            for i, (func, args, kwargs) in enumerate(tasks):
+                results[i] = func(*args, **kwargs)
+                if progress is not None:
+                    progress(i, i + 1, len(tasks))
+            return results
+        futures = {self.pool.submit(func, *args, **kwargs): i for i, (func, args, kwargs) in enumerate(tasks)}
+        for done, future in enumerate(as_completed(futures), 1):
+            i = futures[future]
+            results[i] = future.result()
+            if progress is not None:
+                progress(i, done, len(tasks))
+        return results
+
+    @property
+    def serial(self):
+        # True if tasks run in this process (no worker processes)
+        return self.pool is None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        elif self.finalizer is not None:
+            self.finalizer()
+        self.finalizer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def run_tasks(tasks, jobs=1, progress=None, initializer=None, initargs=()):
+    # tasks is a list of (function, args, kwargs). Results are returned in task order.
+    # progress(task_index, number_done, number_of_tasks) is called in this process as each task finishes.
+    # initializer(*initargs) runs once in each worker (or here, when running serially) before its tasks, so
+    # large shared inputs are sent to each worker once instead of with every task.
+    jobs = min(jobs, len(tasks)) if len(tasks) > 1 else 1
+    with TaskRunner(jobs, initializer, initargs) as runner:
+        return runner.run(tasks, progress)
@@ -0,0 +1,138 @@
+#Commands to add extra functionality to ChimeraX.
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+import os
+import numpy as np
+import chimerax_mrc_io as mrc_io
+from chimerax_orientations import euler_matrices, projection_angles
+
+
+def projection_spectrum(volume, pad=2.0, workers=1):
+    # Padded, gridding corrected rfftn of a cubic volume for Fourier slice projection. The volume centre
+    # (index n//2) is the phase origin, and the z and y frequencies are shifted so frequency 0 is at N//2.
+    # Dividing by sinc^2 in real space undoes the apodization of trilinear interpolation in Fourier space.
+    from scipy import fft
+    volume = np.asarray(volume, dtype=np.float32)
+    n = volume.shape[0]
+    big = int(round(pad * n))
+    big += big % 2
+    padded = np.zeros((big, big, big), dtype=np.float32)
+    c0 = big // 2 - n // 2
+    padded[c0:c0 + n, c0:c0 + n, c0:c0 + n] = volume
+    correction = (np.sinc((np.arange(big) - big // 2) / big) ** 2).astype(np.float32)
+    padded /= correction[:, None, None]
+    padded /= correction[None, :, None]
+    padded /= correction[None, None, :]
+    spectrum = fft.rfftn(fft.ifftshift(padded), workers=workers)
+    del padded
+    return fft.fftshift(spectrum, axes=(0, 1)), big
+
+
+def project_batch(spectrum, big, n, matrices, workers=1):
+    # Projections (n x n images) along the z axis of the volume rotated by each matrix: the central slice
+    # A^T (kx, ky, 0) of the 3D transform, trilinear interpolation of all slices at once, then inverse 2D FFTs.
+    # Only the kx >= 0 half is stored, so points with qx < 0 use the complex conjugate at -q.
+    from scipy import fft
+    half = big // 2
+    ky = (np.fft.fftfreq(big) * big).astype(np.float32)
+    kx = np.arange(half + 1, dtype=np.float32)
+    inside = (ky[:, None] ** 2 + kx[None, :] ** 2) < (half - 1) ** 2
+    m = np.asarray(matrices, dtype=np.float32)
+    q = m[:, None, None, 0, :] * kx[None, None, :, None] + m[:, None, None, 1, :] * ky[None, :, None, None]
+    flip = q[..., 0] < 0
+    q[flip] *= -1
+    q[..., 1:] += half # shifted z and y frequencies
+    q[~np.broadcast_to(inside, flip.shape)] = 0 # outside the sphere: any valid index, zeroed below
+    i0 = np.floor(q).astype(np.intp)
+    t = q - i0
+    flat = spectrum.reshape(-1)
+    nz, ny, nx = spectrum.shape
+    slices = np.zeros(flip.shape, dtype=np.complex64)
+    for dx in (0, 1):
+        wx = t[..., 0] if dx else 1 - t[..., 0]
+        for dy in (0, 1):
+            wy = t[..., 1] if dy else 1 - t[..., 1]
+            for dz in (0, 1):
+                wz = t[..., 2] if dz else 1 - t[..., 2]
+                index = ((i0[..., 2] + dz) * ny + (i0[..., 1] + dy)) * nx + (i0[..., 0] + dx)
+                slices += flat[index] * (wx * wy * wz)
+    np.conjugate(slices, out=slices, where=flip)
+    slices *= inside
+    images = fft.irfft2(slices, s=(big, big), workers=workers)
+    images = fft.fftshift(images, axes=(1, 2))
+    c0 = half - n // 2
+    return images[:, c0:c0 + n, c0:c0 + n].astype(np.float32)
+
+
+def projection_stack_arrays(volume, angles, out, pad=2.0, threads=1, batch_points=2**21):
+    # Fill out (len(angles) x n x n, e.g. a memory mapped MRCS) with projections of volume, a batch of
+    # orientations at a time (with threads, batches run in parallel), so memory stays bounded for any count.
+    spectrum, big = projection_spectrum(volume, pad, workers=threads)
+    n = volume.shape[0]
+    matrices = euler_matrices(angles)
+    batch = max(1, batch_points // (big * (big // 2 + 1)))
+
+    def project(start):
+        out[start:start + batch] = project_batch(spectrum, big, n, matrices[start:start + batch])
+
+    starts = range(0, len(matrices), batch)
+    if threads > 1:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(project, starts))
+    else:
+        for start in starts:
+            project(start)
+    return out
+
+
+def write_star(path, stack_path, angles):
+    # RELION style list of the images and their angles.
+    with open(path, 'w') as f:
+        f.write('\ndata_images\n\nloop_\n_rlnImageName #1\n_rlnAngleRot #2\n_rlnAngleTilt #3\n_rlnAnglePsi #4\n')
+        name = os.path.basename(stack_path)
+        for i, (rot, tilt, psi) in enumerate(angles, 1):
+            f.write('%06d@%s %10.4f %10.4f %10.4f\n' % (i, name, rot, tilt, psi))
+
+
+def projection_stack(session, volume, output, count=None, step=None, psi_step=0.0, pad=2.0, threads=1):
+    from chimerax.core.errors import UserError
+    data = volume.data
+    if len(set(data.size)) != 1:
+        raise UserError("Projections need a cubic map (#%s is %s)." % (volume.id_string, 'x'.join(str(s) for s in data.size)))
+    if count is None and step is None:
+        count = 100
+    angles = projection_angles(count=count, step=step, psi_step=psi_step)
+    n = data.size[0]
+    session.logger.status('Projecting #%s in %d orientations to %s...' % (volume.id_string, len(angles), output), log=True)
+    header = mrc_io.new_header((len(angles), n, n), voxel_size=data.step, stack=True)
+    out = mrc_io.create(output, header)
+    projection_stack_arrays(volume.full_matrix(), angles, out, pad=pad, threads=threads)
+    out.flush()
+    mrc_io.update_statistics(output, out)
+    del out
+    star_path = os.path.splitext(output)[0] + '.star'
+    write_star(star_path, output, angles)
+    session.logger.status('Written %d projections of %d x %d pixels to %s (angles in %s)'
+                          % (len(angles), n, n, output, star_path), log=True)
+
+
+def register_command(logger):
+    from chimerax.core.commands import CmdDesc, register, FloatArg, IntArg, SaveFileNameArg
+    from chimerax.map import MapArg
+
+    desc = CmdDesc(
+        required=[('volume', MapArg)], #Cubic map, e.g. from molmap cube
+        keyword=[('output', SaveFileNameArg), #MRCS stack to write (angles go in a .star file next to it)
+                 ('count', IntArg), #Number of projection directions, evenly spread. Default 100.
+                 ('step', FloatArg), #Or the angle (degrees) between neighbouring directions
+                 ('psi_step', FloatArg), #In-plane rotations every psi_step degrees. Default none.
+                 ('pad', FloatArg), #Fourier padding factor. Default 2.
+                 ('threads', IntArg)], #Default 1
+        required_arguments=['output'],
+        synopsis='Stack of 2D projections of a map for templates.')
+    register('projection stack', desc, projection_stack, logger=logger)
+
+
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
@@ -2,11 +2,23 @@
 #Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
 
 import os
+import sys
 import numpy as np
 
+script_dir = os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else os.getcwd()
+
+
+def forget_helper_modules():
+    # Helper modules imported by the scripts are cached in sys.modules. Drop them so edits are picked up.
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None)
+        if path and os.path.dirname(os.path.abspath(path)) == script_dir:
+            del sys.modules[name]
+
 
 def reload_scripts(session):
     from chimerax.cmd_line.tool import CommandLine
+    forget_helper_modules()
     c = session.tools.find_by_class(CommandLine)[0]
     c._run_startup_commands()
     session.logger.status('Startup commands re-executed.', log=True)
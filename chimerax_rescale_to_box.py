@@ -0,0 +1,133 @@
+#Commands to add extra functionality to ChimeraX.
+#Written by Robert Stass, Bowden group, STRUBI/OPIC (2025)
+
+import os
+import numpy as np
+import chimerax_mrc_io as mrc_io
+import chimerax_fourier as fourier
+
+
+def rescale_mrc(in_path, out_path, new_step, new_shape, start=0.0, origin=None, memory=2048, threads=1, log=print,
+                step=None):
+    # Out-of-core chimerax_fourier.rescale for MRC files (all arguments in array axis order z, y, x, origin x, y, z).
+    # One axis at a time: slabs holding whole lines along that axis are read from a memory map, rescaled and
+    # written to a memory mapped temporary file (the output file for the last axis). memory is in MB.
+    # step is the input pixel size, by default the voxel size in the header.
+    import tempfile
+    header, data = mrc_io.open_data(in_path)
+    if step is None:
+        step = mrc_io.header_voxel_size(header)[::-1]
+    step = np.broadcast_to(np.asarray(step, dtype=np.float64), (3,))
+    new_step = np.broadcast_to(np.asarray(new_step, dtype=np.float64), (3,))
+    start = np.broadcast_to(np.asarray(start, dtype=np.float64), (3,))
+    new_shape = tuple(int(n) for n in new_shape)
+    work_dir = os.path.dirname(os.path.abspath(out_path))
+    current = data
+    temp_paths = []
+    try:
+        for axis in range(3):
+            shape = list(current.shape)
+            shape[axis] = new_shape[axis]
+            if axis == 2:
+                out = mrc_io.create(out_path, mrc_io.new_header(new_shape, voxel_size=new_step[::-1], origin=origin, like=header))
+            else:
+                with tempfile.NamedTemporaryFile(dir=work_dir, suffix='.tmp', delete=False) as f:
+                    temp_paths.append(f.name)
+                out = np.memmap(f.name, dtype=np.float32, mode='w+', shape=tuple(shape))
+            chunk_axis = 1 if axis == 0 else 0
+            line = max(current.shape[axis], new_shape[axis], int(np.ceil(2 * current.shape[axis] * step[axis] / new_step[axis])))
+            plane = line * int(np.prod([current.shape[a] for a in range(3) if a not in (axis, chunk_axis)]))
+            slab = int(memory * 2**20 // (plane * 24)) # input, complex FFT, oversampled and output lines
+            if slab < 1:
+                raise ValueError("Memory budget of %d MB is too small: one slab needs at least %d MB."
+                                 % (memory, np.ceil(plane * 24 / 2**20)))
+            for c0 in range(0, current.shape[chunk_axis], slab):
+                c1 = min(c0 + slab, current.shape[chunk_axis])
+                log("Rescaling axis %s, %d-%d of %d..." % ('zyx'[axis], c0, c1 - 1, current.shape[chunk_axis]))
+                region = [slice(None)] * 3
+                region[chunk_axis] = slice(c0, c1)
+                region = tuple(region)
+                out[region] = fourier.rescale_axis(np.asarray(current[region]), axis, step[axis], new_step[axis],
+                                                   new_shape[axis], start=start[axis], workers=threads)
+            out.flush()
+            current = out
+        mrc_io.update_statistics(out_path, current)
+        del out, current
+    finally:
+        for path in temp_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return out_path
+
+
+def rescale_to_box(session, volume, size=None, spacing=None, like=None, center=False, threads=1, tiled=False, memory=2048, output=None):
+    from chimerax.map_data import ArrayGridData
+    from chimerax.map import volume_from_grid_data
+    from chimerax.core.commands import run
+    from chimerax.core.errors import UserError
+    data = volume.data
+    step = np.array(data.step, dtype=float)
+    n = np.array(data.size)
+    if like is not None:
+        size, spacing = like.data.size, like.data.step
+    if size is None and spacing is None:
+        raise UserError("Give a size and/or spacing, or a map to match with like.")
+    if spacing is None:
+        spacing = n * step / np.broadcast_to(size, (3,)) # same box in Angstrom
+    elif size is None:
+        size = np.rint(n * step / np.broadcast_to(spacing, (3,)))
+    size = np.broadcast_to(np.asarray(size), (3,)).astype(int)
+    spacing = np.broadcast_to(np.asarray(spacing, dtype=float), (3,))
+    # Sample 0 stays where it was (same origin) unless keeping the box centre
+    start = (n * step - size * spacing) / 2 if center else np.zeros(3)
+    origin = data.ijk_to_xyz(start / step)
+    session.logger.status('Rescaling #%s from %s pixels of %s A to %s pixels of %s A...'
+                          % (volume.id_string, 'x'.join('%d' % s for s in n), ','.join('%.4g' % s for s in step),
+                             'x'.join('%d' % s for s in size), ','.join('%.4g' % s for s in spacing)), log=True)
+    if tiled:
+        in_path = data.path
+        if getattr(data, 'file_type', None) not in ('mrc', 'ccp4') or not os.path.isfile(in_path):
+            raise UserError("Tiled mode needs a map opened from an MRC file (#%s)." % volume.id_string)
+        if output is None:
+            split_path = os.path.splitext(in_path)
+            output = split_path[0] + '_rescaled' + split_path[1]
+        # The session's pixel size, which may have been changed since the file was opened (volume voxelSize)
+        rescale_mrc(in_path, output, spacing[::-1], size[::-1], start=start[::-1], origin=origin, memory=memory,
+                    threads=threads, log=lambda msg: session.logger.status(msg), step=step[::-1])
+        session.logger.status("Rescaled map written to %s" % output, log=True)
+        new_v = run(session, 'open "%s" format mrc' % output)[0]
+        new_v.data.set_origin(origin)
+        new_v.data.set_step(spacing)
+    else:
+        values = fourier.rescale(volume.full_matrix(), step[::-1], spacing[::-1], size[::-1], start=start[::-1], workers=threads)
+        grid = ArrayGridData(values, origin=origin, step=spacing, cell_angles=data.cell_angles, rotation=data.rotation,
+                             symmetries=data.symmetries, name='%s rescaled' % volume.name)
+        new_v = volume_from_grid_data(grid, session)
+        if output is not None:
+            mrc_io.write_mrc(output, values, voxel_size=spacing, origin=origin)
+            session.logger.status("Rescaled map written to %s" % output, log=True)
+    new_v.scene_position = volume.scene_position
+    return new_v
+
+
+def register_command(logger):
+    from chimerax.core.commands import CmdDesc, register, BoolArg, IntArg, Int1or3Arg, Float1or3Arg, SaveFileNameArg
+    from chimerax.map import MapArg
+
+    desc = CmdDesc(
+        required=[('volume', MapArg)],
+        keyword=[('size', Int1or3Arg), #Box size in pixels. Default keeps the box size in Angstrom.
+                 ('spacing', Float1or3Arg), #Angstrom per pixel. Default keeps the box size in Angstrom.
+                 ('like', MapArg), #Take the size and spacing from this map
+                 ('center', BoolArg), #Default False (keep the origin). True keeps the box centre.
+                 ('threads', IntArg), #FFT threads. Default 1.
+                 ('tiled', BoolArg), #Default False. Stream the MRC file an axis at a time instead of loading the whole map.
+                 ('memory', IntArg), #Peak memory budget (MB) for tiled mode. Default 2048.
+                 ('output', SaveFileNameArg)], #Output MRC file (tiled mode defaults to <input>_rescaled.mrc)
+        required_arguments=[],
+        synopsis='Fourier crop/pad a map to a new box size and pixel size.')
+    register('rescale to box', desc, rescale_to_box, logger=logger)
+
+
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
@@ -3,6 +3,8 @@
 
 import os
 import numpy as np
+import chimerax_fit_search as fit_search
+import chimerax_map_cache as map_cache
 
 
 def is_map_or_atoms(session, atomspec):
@@ -40,15 +42,83 @@ def parse_map_or_atoms(session, atomspec):
     else:
         return map[0][0]
 
-def rough_fitmap(session, atoms_or_map, inmap, search=50, radius=50, sym=False, refine=False):
+def coarse_atoms(atoms, min_atoms=20):
+    # One atom per residue (CA, or P for nucleic acids) for the coarse levels of a multiresolution search.
+    coarse = atoms.filter(np.isin(atoms.names, ('CA', 'P')))
+    return coarse if len(coarse) >= min_atoms else atoms
+
+
+def search_levels(volume, engine, levels=None):
+    # Binning levels for the search: by default up to 64^3 for engine fft and none for numpy.
+    if levels is None:
+        levels = fit_search.fft_levels(volume.data.size) if engine == 'fft' else 0
+    return levels
+
+
+def search_poses(session, atoms, volume, search, radius, seed=None, jobs=1, levels=0, keep=5, engine='numpy',
+                 angle_step=15.0, threads=1, operators=None, converge=None, runner=None):
+    # fit_search (or multiresolution_search with levels, or its fft_search with engine fft) of the atoms in the map,
+    # with symmetry operators if given, stopping early with converge. Returns the scores, 3x4 scene transforms and
+    # cluster sizes of the distinct poses, best first. The map's gradients and binned copies come from the session
+    # map cache. runner (fit_search.search_runner of that pyramid) keeps the worker processes between searches.
+    levels = search_levels(volume, engine, levels)
+    pyramid = map_cache.map_pyramid(session, volume, levels)
+    xyz_to_ijk = (volume.data.xyz_to_ijk_transform * volume.scene_position.inverse()).matrix
+    return fit_search.multiresolution_search(
+        pyramid[0], volume.data.step[::-1], xyz_to_ijk, atoms.scene_coords, coarse_atoms(atoms).scene_coords,
+        count=search, radius=radius, seed=seed, jobs=jobs, levels=levels, keep=keep, engine=engine,
+        angle_step=angle_step, threads=threads, pyramid=pyramid, operators=operators, converge=converge, runner=runner,
+        log=lambda msg: session.logger.status(msg, log=True),
+        progress=lambda i, done, total: session.logger.status('Fitted %d of %d placements' % (done, total)))
+
+
+def numpy_search(session, atoms, volume, search, radius, seed=None, jobs=1, levels=0, keep=5, engine='numpy',
+                 angle_step=15.0, threads=1, operators=None, converge=None):
+    # search_poses, then the best pose is applied and the clusters are listed. Returns the scores and transforms.
+    from chimerax.core.errors import UserError
+    if len(atoms) == 0:
+        raise UserError("Engine %s fits atoms, not maps." % engine)
+    if engine == 'fft':
+        session.logger.status('Searching rotations %.3g degrees apart for %d atoms in #%s (%d threads)...'
+                              % (angle_step, len(atoms), volume.id_string, threads), log=True)
+    else:
+        session.logger.status('Searching %d placements of %d atoms in #%s (%d jobs)...'
+                              % (search, len(atoms), volume.id_string, jobs), log=True)
+    scores, transforms, sizes = search_poses(session, atoms, volume, search, radius, seed=seed, jobs=jobs,
+                                             levels=levels, keep=keep, engine=engine, angle_step=angle_step,
+                                             threads=threads, operators=operators, converge=converge)
+    stats = map_cache.map_statistics(session, volume)
+    lines = ['%7s %6s %12s %8s %10s %10s' % ('cluster', 'poses', 'mean value', 'SDs', 'shift (A)', 'turn (deg)')]
+    center = atoms.scene_coords.mean(axis=0)
+    for rank, (score, t, size) in enumerate(zip(scores[:10], transforms[:10], sizes[:10]), 1):
+        shift = np.linalg.norm(t[:, :3] @ center + t[:, 3] - center)
+        angle = np.degrees(np.arccos(np.clip((np.trace(t[:, :3]) - 1) / 2, -1, 1)))
+        sds = (score - stats['mean']) / stats['sd'] if stats['sd'] > 0 else 0.0
+        lines.append('%7d %6d %12.5g %8.2f %10.2f %10.1f' % (rank, size, score, sds, shift, angle))
+    session.logger.info('\n'.join(lines))
+    fit_search.apply_transform(atoms.unique_structures, transforms[0])
+    session.logger.status('Best placement: mean map value %.5g' % scores[0], log=True)
+    return scores, transforms
+
+
+def rough_fitmap(session, atoms_or_map, inmap, search=50, radius=50, sym=False, refine=False, engine='fitmap', jobs=1, seed=None, levels=None, keep=5, angle_step=15.0, threads=1, converge=None):
     from chimerax.core.commands import run, AtomSpecArg
     from chimerax.std_commands import wait
-    from chimerax.atomic.cmd import combine_cmd
-    from chimerax.atomic import AtomicStructuresArg
+    from chimerax.atomic import AtomsArg
+    from chimerax.core.errors import UserError
     from chimerax.core.commands.cli import command_function
     align_center = command_function("align center")
 
     ismap = is_map_or_atoms(session, atoms_or_map.spec)
+    if levels and engine == 'fitmap':
+        raise UserError("The multiresolution search (levels) needs engine numpy or fft.")
+    if engine == 'numpy' and search < 1:
+        raise UserError("Engine numpy needs at least one start (search %d)." % search)
+    if converge and engine != 'numpy':
+        if engine == 'fft':
+            raise UserError("Early stopping (converge) needs engine numpy (engine fft searches every rotation).")
+        session.logger.info('Early stopping (converge) uses engine numpy.')
+        engine = 'numpy'
     atoms_or_map_id = atoms_or_map.spec
     map_id = '#' + inmap[0].id_string
 
@@ -60,68 +130,224 @@ def rough_fitmap(session, atoms_or_map, inmap, search=50, radius=50, sym=False,
         run(session, cmd)
 
 
-    if sym and not ismap:
-        orig_models = session.models._models.copy()
-        cmd = 'sym %s biomt' % atoms_or_map_id
-        print(cmd)
-        run(session, cmd)
-        dif = session.models._models.keys()-orig_models #find new id
-        new_ids = [key for key in dif if len(key) == 1]
-        if len(new_ids) > 0:
-            atoms_or_map_id = '#'+str(new_ids[0][0])
-
-
     a = AtomSpecArg()
     A = a.parse(atoms_or_map_id, session)
     parsed_atoms_or_map = parse_map_or_atoms(session, A[0])
 
-    cmd = 'align center %s to %s' % (atoms_or_map_id, map_id)
-    print(cmd)
-    align_center(session, parsed_atoms_or_map, inmap[0])
+    operators = None
+    if sym and not ismap:
+        # Score the asymmetric unit with its BIOMT operators rather than fitting symmetry copies
+        structure = parsed_atoms_or_map.unique_structures[0]
+        operators = fit_search.symmetry_operators(structure)
+        if operators is None:
+            raise UserError("No BIOMT (assembly) operators found for #%s." % structure.id_string)
+        if engine == 'fitmap':
+            session.logger.info('Symmetric fitting uses engine numpy (fitmap scores the atoms it is given only).')
+            engine = 'numpy'
+        from chimerax.geometry import translation
+        from chimerax_centroids import volume_center
+        assembly_center = fit_search.symmetry_frame(parsed_atoms_or_map.scene_coords, operators)[0]
+        print('align center (assembly of %d copies) %s to %s' % (len(operators), atoms_or_map_id, map_id))
+        fit_search.apply_transform(parsed_atoms_or_map.unique_structures,
+                                   translation(volume_center(session, inmap[0]) - assembly_center).matrix)
+        operators = fit_search.symmetry_operators(structure)
+    else:
+        cmd = 'align center %s to %s' % (atoms_or_map_id, map_id)
+        print(cmd)
+        align_center(session, parsed_atoms_or_map, inmap[0])
 
     wait.wait(session,1) #update view
 
-    if sym and not ismap:
-        # combine to make fitmap work following symmetry command.
-        cmd = 'combine %s' % (atoms_or_map_id)
-        print(cmd)
-        a = AtomicStructuresArg()
+    if engine in ('numpy', 'fft'):
+        a = AtomsArg()
         A = a.parse(atoms_or_map_id, session)
-        atoms_or_map = combine_cmd(session, A[0])
-        cmd = 'hide %s models' % atoms_or_map_id
+        numpy_search(session, A[0], inmap[0], search, radius, seed=seed, jobs=jobs, levels=levels, keep=keep,
+                     engine=engine, angle_step=angle_step, threads=threads, operators=operators, converge=converge)
+    else:
+        cmd = 'fitmap %s inmap %s search %d radius %d' % (atoms_or_map_id, map_id, search, radius)
         print(cmd)
         run(session, cmd)
-        atoms_or_map_id = '#'+atoms_or_map.id_string
-
-    cmd = 'fitmap %s inmap %s search %d radius %d' % (atoms_or_map_id, map_id, search, radius)
-    print(cmd)
-    run(session, cmd)
 
     wait.wait(session, 30)  # update view
 
-    if refine: #repeat fitmap command without search
+    if refine and operators is not None: #fitmap would fit the asymmetric unit on its own
+        fit_search.symmetric_refine(session, A[0], inmap[0], fit_search.symmetry_operators(structure))
+    elif refine: #repeat fitmap command without search
         cmd = 'fitmap %s inmap %s' % (atoms_or_map_id, map_id)
         print(cmd)
         run(session, cmd)
 
+    if operators is not None: #show the copies (graphics only, no new atoms)
+        cmd = 'sym %s biomt newModel false' % atoms_or_map_id
+        print(cmd)
+        run(session, cmd)
+
     return atoms_or_map_id, map_id
 
 
 
+BATCH_COLUMNS = ['model', 'atoms', 'mean_value', 'atoms_inside', 'fraction_inside', 'overlap', 'correlation',
+                 'clusters', 'cluster_size'] + \
+                ['m%d%d' % (i, j) for i in range(3) for j in range(4)] + ['error']
+
+
+def rough_fitmap_batch(session, inmap, files=None, models=None, output=None, search=50, radius=50, refine=True,
+                       engine='fitmap', jobs=1, seed=None, levels=None, keep=5, angle_step=15.0, threads=1, level=None,
+                       resolution=None, converge=None):
+    # rough fitmap for many models against one map, for --nogui screening: no view waits, display changes or echoed
+    # commands. Files are opened, fitted, measured and closed one at a time so memory stays flat, while the map
+    # values (and binned copies) are prepared once in the session map cache and sent once to the worker processes.
+    # One row per model (fit_metrics and the final scene transform) is written to output, as CSV (rows written as
+    # they finish) or JSON (.json). Engines numpy and fft also give the number of distinct poses and the size of
+    # the best cluster. A model that cannot be opened or fitted is logged and gets a row with just its error.
+    import csv
+    import glob
+    import json
+    from chimerax.core.commands import run
+    from chimerax.core.errors import UserError
+    from chimerax.atomic import AtomicStructure, concatenate
+    from chimerax.geometry import translation
+    from chimerax_centroids import volume_center
+    if output is None:
+        raise UserError("Give an output file for the results table (.csv or .json).")
+    paths = []
+    for pattern in (files or []):
+        matches = sorted(glob.glob(os.path.expanduser(pattern)))
+        paths.extend(matches if matches else [pattern])
+    sources = [(path, None) for path in paths] + [(None, s) for s in (models or [])]
+    if not sources:
+        raise UserError("Give model files and/or open models to fit.")
+    volume = inmap
+    map_id = '#' + volume.id_string
+    xyz_to_ijk = (volume.data.xyz_to_ijk_transform * volume.scene_position.inverse()).matrix
+    if level is None:
+        level = volume.minimum_surface_level
+        if level is None:
+            level = map_cache.map_statistics(session, volume)['contour']
+    if resolution is None:
+        resolution = 4 * max(volume.data.step)
+    map_center = volume_center(session, volume, level=level)
+
+    rows = []
+    fitted = 0
+    failed = 0
+    f = open(output, 'w', newline='')
+    writer = None
+    if not output.lower().endswith('.json'):
+        writer = csv.DictWriter(f, fieldnames=BATCH_COLUMNS)
+        writer.writeheader()
+    runner = None
+    try:
+        if engine != 'fitmap': # one set of worker processes, given the map once, for all the models
+            levels = search_levels(volume, engine, levels)
+            runner = fit_search.search_runner(map_cache.map_pyramid(session, volume, levels), jobs)
+        for n, (path, structure) in enumerate(sources, 1):
+            name = os.path.basename(path) if path is not None else '#' + structure.id_string
+            opened = []
+            try: # one bad model (unreadable file, failed fit) gives a failed row rather than stopping the batch
+                if path is not None:
+                    opened = run(session, 'open "%s"' % path, log=False)
+                structures = [m for o in opened for m in o.all_models() if isinstance(m, AtomicStructure)]
+                if structure is not None:
+                    structures = [structure]
+                if not structures:
+                    raise UserError('No atomic model in %s.' % name)
+                session.logger.status('Fitting %s (%d of %d)...' % (name, n, len(sources)))
+                atoms = concatenate([s.atoms for s in structures])
+                shift = translation(map_center - atoms.scene_coords.mean(axis=0))
+                for s in structures:
+                    s.scene_position = shift * s.scene_position
+                spec = '|'.join('#' + s.id_string for s in structures)
+                row = {'model': name, 'atoms': len(atoms)}
+                if engine == 'fitmap':
+                    run(session, 'fitmap %s inmap %s search %d radius %d' % (spec, map_id, search, radius), log=False)
+                else:
+                    scores, transforms, sizes = search_poses(session, atoms, volume, search, radius, seed=seed,
+                                                             jobs=jobs, levels=levels, keep=keep, engine=engine,
+                                                             angle_step=angle_step, threads=threads,
+                                                             converge=converge, runner=runner)
+                    fit_search.apply_transform(structures, transforms[0])
+                    row.update(clusters=len(sizes), cluster_size=int(sizes[0]))
+                if refine:
+                    run(session, 'fitmap %s inmap %s' % (spec, map_id), log=False)
+                values = map_cache.map_values(session, volume) # a view of the cached gradients, not a copy
+                row.update(fit_search.fit_metrics(values, xyz_to_ijk, volume.data.step, atoms.scene_coords, level,
+                                                  resolution))
+                row['fraction_inside'] = row['atoms_inside'] / len(atoms)
+                row.update(('m%d%d' % (i, j), v) for (i, j), v in np.ndenumerate(structures[0].scene_position.matrix))
+                session.logger.status('%s: mean map value %.5g, correlation %.4f, %d of %d atoms inside'
+                                      % (name, row['mean_value'], row['correlation'], row['atoms_inside'], len(atoms)),
+                                      log=True)
+                fitted += 1
+            except Exception as e:
+                session.logger.warning('%s failed (%s), skipped.' % (name, e))
+                row = {'model': name, 'error': str(e) or type(e).__name__}
+                failed += 1
+            finally:
+                if opened:
+                    session.models.close(opened)
+                    session.undo.clear()
+            if writer is not None:
+                writer.writerow(row)
+                f.flush()
+            else:
+                rows.append(row)
+        if writer is None:
+            json.dump(rows, f, indent=1)
+    finally:
+        f.close()
+        if runner is not None:
+            runner.close()
+    session.logger.status('Fitted %d models%s, results in %s' % (fitted, ', %d failed' % failed if failed else '', output),
+                          log=True)
+
+
 def register_command(logger):
-    from chimerax.core.commands import CmdDesc, register, IntArg, ModelArg, StringArg, BoolArg, ObjectsArg
-    from chimerax.map import MapsArg
-    from chimerax.atomic import AtomsArg
+    from chimerax.core.commands import CmdDesc, register, IntArg, ModelArg, StringArg, BoolArg, ObjectsArg, EnumOf, FloatArg
+    from chimerax.core.commands import OpenFileNamesArg, SaveFileNameArg
+    from chimerax.map import MapsArg, MapArg
+    from chimerax.atomic import AtomsArg, AtomicStructuresArg
     desc = CmdDesc(
         required=[('atoms_or_map', ObjectsArg)],
         keyword=[('inmap', MapsArg),
                  ('search', IntArg), #default 50
                  ('radius', IntArg), #default 50
-                 ('sym', BoolArg), #symmetrize first (by biomt info in file header)
-                 ('refine', BoolArg)], #Run a standard, non-search fitmap command after rough fit.
+                 ('sym', BoolArg), #fit the assembly from the biomt info in the file header (engine numpy or fft)
+                 ('refine', BoolArg), #Run a standard, non-search fitmap command after rough fit.
+                 ('engine', EnumOf(('fitmap', 'numpy', 'fft'))), #Default fitmap. numpy: parallel search of atoms (see jobs, seed). fft: exhaustive rotation grid.
+                 ('jobs', IntArg), #Worker processes for engine numpy. Default 1.
+                 ('seed', IntArg), #Random seed for engine numpy (the same seed gives the same result for any jobs)
+                 ('levels', IntArg), #Search a map binned 2**levels times with CA atoms first. Default 0 (numpy), up to 64^3 (fft).
+                 ('keep', IntArg), #Number of best coarse poses refined at each finer level. Default 5.
+                 ('angle_step', FloatArg), #Engine fft: degrees between rotations. Default 15.
+                 ('threads', IntArg), #Engine fft: threads for the rotations. Default 1.
+                 ('converge', IntArg)], #Engine numpy: stop once the best cluster has this many poses and its score is stable. Default off.
         required_arguments=['atoms_or_map', 'inmap'],
         synopsis='Initial approximate fitmap command.')
     register('rough fitmap', desc, rough_fitmap, logger=logger)
 
+    desc = CmdDesc(
+        required=[('inmap', MapArg)],
+        keyword=[('files', OpenFileNamesArg), #Model files to open, fit and close one at a time (wildcards allowed)
+                 ('models', AtomicStructuresArg), #And/or open models (fitted in place, left open)
+                 ('output', SaveFileNameArg), #Results table, .csv or .json
+                 ('search', IntArg), #default 50
+                 ('radius', IntArg), #default 50
+                 ('refine', BoolArg), #default True
+                 ('engine', EnumOf(('fitmap', 'numpy', 'fft'))), #default fitmap
+                 ('jobs', IntArg),
+                 ('seed', IntArg),
+                 ('levels', IntArg),
+                 ('keep', IntArg),
+                 ('angle_step', FloatArg),
+                 ('threads', IntArg),
+                 ('level', FloatArg), #Contour level for atoms inside. Default the map's surface level.
+                 ('resolution', FloatArg), #molmap resolution for the correlation and overlap. Default 4 pixels.
+                 ('converge', IntArg)], #Engine numpy: stop early once the best cluster has this many poses
+        required_arguments=['inmap', 'output'],
+        synopsis='Rough fitmap for many models against one map, with a results table.')
+    register('rough fitmap batch', desc, rough_fitmap_batch, logger=logger)
+
 
-register_command(session.logger)
\ No newline at end of file
+if 'session' in globals(): # opened as a ChimeraX script (not imported as a module)
+    register_command(session.logger)
\ No newline at end of file
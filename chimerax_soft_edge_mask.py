@@ -3,49 +3,273 @@
 
 import os
 import numpy as np
-from scipy.ndimage import distance_transform_edt, binary_dilation
+import chimerax_mrc_io as mrc_io
+import chimerax_distance_transform as dt
 
 
-def extend_and_soften_mask(img_in, ini_threshold, extend_ini_mask, width_soft_mask_edge):
-    # Initialize the mask output array
+def raised_cosine_edge(distances, width):
+    # In place: 1 at distance 0 falling to 0 at distance >= width (same arithmetic as relion_mask_create).
+    np.minimum(distances, width, out=distances)
+    distances *= np.pi
+    distances /= width
+    np.cos(distances, out=distances)
+    distances *= 0.5
+    distances += 0.5
+    return distances
+
+
+def extend_mask(msk, extend_ini_mask, low_memory=False, threads=1):
+    # Extend (extend > 0) or shrink (extend < 0) a binary mask in place by a distance in pixels.
+    if extend_ini_mask > 0:
+        target = msk
+    else:
+        target = ~msk
+    if low_memory:
+        within = dt.bounded_squared_distances(target, abs(extend_ini_mask), threads=threads) <= extend_ini_mask ** 2
+    else:
+        within = dt.distance_to_mask(target, abs(extend_ini_mask), threads=threads) <= abs(extend_ini_mask)
+    if extend_ini_mask > 0:
+        msk |= within
+    else:
+        msk &= ~within
+    return msk
+
+
+def edge_padding(extend_ini_mask, width_soft_mask_edge):
+    # Voxels beyond the thresholded region that extend/shrink and the soft edge can reach (plus one so a
+    # shrink always sees background). Used both to crop to the particle and as the halo between tiles.
+    return int(np.ceil(abs(extend_ini_mask))) + int(np.ceil(max(width_soft_mask_edge, 0))) + 1
+
+
+def mask_bounds(msk, pad):
+    # Slices covering the True voxels of msk padded by pad voxels (clipped to the array)
+    bounds = []
+    for axis in range(msk.ndim):
+        other_axes = tuple(a for a in range(msk.ndim) if a != axis)
+        hits = np.flatnonzero(msk.any(axis=other_axes))
+        bounds.append(slice(max(hits[0] - pad, 0), min(hits[-1] + pad + 1, msk.shape[axis])))
+    return tuple(bounds)
+
+
+def mask_distances(img_in, ini_threshold, extend_ini_mask, max_width, low_memory=False, crop=True, threads=1):
+    # Binarize and extend/shrink, then find the distance from every voxel to the extended mask (exact out to
+    # max_width). Returns (bounds, distances, squared), or None if nothing is above the threshold or left after
+    # a shrink. The distances only cover bounds (the whole box if not crop) and are squared float32 values in
+    # low memory mode.
     img_in = np.asarray(img_in)
-    msk_out = np.zeros_like(img_in, dtype=float)
 
     # Calculate initial binary mask based on density threshold
-    msk_out[img_in >= ini_threshold] = 1.0
+    msk = img_in >= ini_threshold
+
+    if not msk.any():
+        return None
+
+    if crop:
+        bounds = mask_bounds(msk, edge_padding(extend_ini_mask, max_width))
+        msk = msk[bounds].copy()
+    else:
+        bounds = tuple(slice(0, n) for n in msk.shape)
 
     # Extend or shrink the initial binary mask
     if extend_ini_mask != 0.0:
+        extend_mask(msk, extend_ini_mask, low_memory=low_memory, threads=threads)
+        if not msk.any(): # shrunk away
+            return None
 
-        extend_size = int(np.abs(np.ceil(extend_ini_mask)))
-        mask_dilated = binary_dilation(msk_out, iterations=extend_size).astype(
-            float) if extend_ini_mask > 0 else binary_dilation(~msk_out.astype(bool), iterations=extend_size)
+    # Distance to the nearest "1" in the mask (for the soft edge)
+    if max_width <= 0.0:
+        return bounds, (~msk).astype(np.float32), True
+    if low_memory:
+        return bounds, dt.bounded_squared_distances(msk, max_width, threads=threads), True
+    return bounds, np.asarray(dt.distance_to_mask(msk, max_width, threads=threads), dtype=float), False
 
-        distances = distance_transform_edt(1 - msk_out if extend_ini_mask > 0 else msk_out)
-        within_extend_distance = distances <= extend_ini_mask
-        msk_out[within_extend_distance] = 1.0 if extend_ini_mask > 0 else 0.0
 
-    # Add a soft edge to the mask if width_soft_mask_edge is specified
-    if width_soft_mask_edge > 0.0:
+def soft_mask_from_distances(shape, mask_dist, width_soft_mask_edge):
+    # Float32 mask of the given shape from the output of mask_distances, with a raised cosine soft edge.
+    # Evaluated slab by slab in float64 so low memory and default modes give identical values.
+    msk_out = np.zeros(shape, dtype=np.float32)
+    if mask_dist is None:
+        return msk_out
+    bounds, distances, squared = mask_dist
+    for slab_out, slab in zip(msk_out[bounds], distances):
+        d = np.sqrt(slab, dtype=float) if squared else slab.copy()
+        if width_soft_mask_edge <= 0.0:
+            slab_out[:] = (d == 0)
+        else:
+            slab_out[:] = raised_cosine_edge(d, width_soft_mask_edge)
+    return msk_out
 
-        # Calculate distances to nearest "1" in the mask for the soft edge
-        distances = distance_transform_edt(1 - msk_out)
-        mask_edge = distances <= width_soft_mask_edge
 
-        # Calculate the soft edge using a raised cosine function
-        mask_soft = np.zeros_like(msk_out)
-        mask_soft[mask_edge] = 0.5 + 0.5 * np.cos(np.pi * distances[mask_edge] / width_soft_mask_edge)
+def extend_and_soften_mask(img_in, ini_threshold, extend_ini_mask, width_soft_mask_edge, low_memory=False, crop=True, threads=1):
+    # Binarize, extend/shrink and add a raised cosine soft edge. Returns float32.
+    # low_memory uses a float32 distance transform bounded to the distances needed, evaluated slab by slab.
+    # crop does the work only in the bounding box of the thresholded voxels padded by extend + width
+    # (the result is identical, everything outside that box is zero).
+    # threads > 1 runs the distance transforms on several cores (see chimerax_distance_transform.py).
+    img_in = np.asarray(img_in)
+    mask_dist = mask_distances(img_in, ini_threshold, extend_ini_mask, width_soft_mask_edge,
+                               low_memory=low_memory, crop=crop, threads=threads)
+    return soft_mask_from_distances(img_in.shape, mask_dist, width_soft_mask_edge)
+
 
-        # Apply the soft edge
-        msk_out[mask_edge] = mask_soft[mask_edge]
+def soft_edge_mask_tiled(in_path, out_path, ini_threshold, extend_ini_mask, width_soft_mask_edge, memory=2048, low_memory=False, crop=True, threads=1, log=print):
+    # Out-of-core version of extend_and_soften_mask for MRC files. Reads slabs of sections (plus a halo of
+    # extend + width) from a memory map and writes each finished slab straight into a memory mapped output file.
+    # memory is the approximate peak RAM budget in MB.
+    header, data = mrc_io.open_data(in_path)
+    nz = data.shape[0]
+    halo = edge_padding(extend_ini_mask, width_soft_mask_edge)
+    bytes_per_voxel = 10 if low_memory else 26 # input copy, binary mask, distance transform work arrays, output
+    section_bytes = data.shape[1] * data.shape[2] * bytes_per_voxel
+    slab = int(memory * 2**20 // section_bytes) - 2 * halo
+    if slab < 1:
+        raise ValueError("Memory budget of %d MB is too small: one tile needs at least %d MB (try low_memory)."
+                         % (memory, np.ceil((2 * halo + 1) * section_bytes / 2**20)))
+    out = mrc_io.create(out_path, mrc_io.new_header(data.shape, like=header))
+    for z0 in range(0, nz, slab):
+        z1 = min(nz, z0 + slab)
+        a, b = max(0, z0 - halo), min(nz, z1 + halo)
+        log("Soft edge mask sections %d-%d of %d..." % (z0, z1 - 1, nz))
+        block = extend_and_soften_mask(data[a:b], ini_threshold, extend_ini_mask, width_soft_mask_edge, low_memory=low_memory, crop=crop, threads=threads)
+        out[z0:z1] = block[z0 - a:z1 - a]
+        out.flush()
+        del block
+    mrc_io.update_statistics(out_path, out)
+    del out
+    return out_path
 
+
+def atoms_soft_mask(ijk, shape, radius, width_soft_mask_edge, threads=1, slab_voxels=2**22):
+    # Soft mask directly from atom positions given as (fractional) grid indices i,j,k. Voxels within radius pixels
+    # of an atom are 1, with the same raised cosine edge as extend_and_soften_mask over the next width pixels.
+    # Atoms go in a k-d tree and only voxels in the padded atom bounding box are queried, a few sections at a time.
+    from scipy.spatial import cKDTree
+    msk_out = np.zeros(shape, dtype=np.float32)
+    if len(ijk) == 0:
+        return msk_out
+    reach = radius + max(width_soft_mask_edge, 0)
+    lo = np.maximum(np.floor(ijk.min(axis=0) - reach), 0).astype(int)
+    hi = np.minimum(np.ceil(ijk.max(axis=0) + reach) + 1, np.array(shape[::-1])).astype(int) # shape is (k, j, i)
+    if np.any(hi <= lo):
+        return msk_out
+    tree = cKDTree(ijk)
+    i = np.arange(lo[0], hi[0])
+    j = np.arange(lo[1], hi[1])
+    section = len(i) * len(j)
+    step = max(1, slab_voxels // section)
+    for k0 in range(lo[2], hi[2], step):
+        k = np.arange(k0, min(k0 + step, hi[2]))
+        kk, jj, ii = np.meshgrid(k, j, i, indexing='ij')
+        points = np.stack([ii.ravel(), jj.ravel(), kk.ravel()], axis=1).astype(float)
+        d, _ = tree.query(points, k=1, distance_upper_bound=reach, workers=threads)
+        d -= radius
+        np.maximum(d, 0, out=d)
+        if width_soft_mask_edge > 0:
+            d[np.isinf(d)] = width_soft_mask_edge
+            values = raised_cosine_edge(d, width_soft_mask_edge)
+        else:
+            values = (d == 0)
+        msk_out[k[0]:k[-1] + 1, lo[1]:hi[1], lo[0]:hi[0]] = values.reshape(kk.shape)
     return msk_out
 
 
-def soft_edge_mask(session, mask, level=0.5, extend=0, width=12):
+def soft_edge_mask_file(in_path, out_path, ini_threshold, extend_ini_mask, width_soft_mask_edge, angstrom=False,
+                        low_memory=False, crop=True, threads=1, tiled=False, memory=2048, log=print):
+    # MRC file in, MRC file out (same origin, cell and pixel size). Needs nothing from ChimeraX.
+    # With angstrom=True, extend and width are given in Angstrom instead of pixels.
+    header = mrc_io.read_header(in_path)
+    if angstrom:
+        pixel_size = mrc_io.header_voxel_size(header)[0]
+        extend_ini_mask /= pixel_size
+        width_soft_mask_edge /= pixel_size
+    if tiled:
+        soft_edge_mask_tiled(in_path, out_path, ini_threshold, extend_ini_mask, width_soft_mask_edge, memory=memory,
+                             low_memory=low_memory, crop=crop, threads=threads, log=log)
+    else:
+        header, data = mrc_io.open_data(in_path)
+        softmask = extend_and_soften_mask(data, ini_threshold, extend_ini_mask, width_soft_mask_edge,
+                                          low_memory=low_memory, crop=crop, threads=threads)
+        del data
+        mrc_io.write_mrc(out_path, softmask, like=header)
+    return out_path
+
+
+def main(argv=None):
+    # Headless use without ChimeraX, e.g.
+    #   python -m chimerax_soft_edge_mask mask1.mrc mask2.mrc --level 0.5 --extend 2 --width 12 --jobs 4
+    import argparse
+    from chimerax_parallel import run_tasks
+    parser = argparse.ArgumentParser(prog='python -m chimerax_soft_edge_mask',
+                                     description='Binarize maps, extend them and apply a raised cosine soft edge (MRC in, MRC out).')
+    parser.add_argument('maps', nargs='+', help='input MRC files')
+    parser.add_argument('--level', type=float, default=0.5, help='binarization threshold (default 0.5)')
+    parser.add_argument('--extend', type=float, default=0.0, help='extend (or shrink if negative) the binary mask (default 0)')
+    parser.add_argument('--width', type=float, default=12.0, help='width of the raised cosine soft edge (default 12)')
+    parser.add_argument('--angstrom', action='store_true', help='extend and width are in Angstrom rather than pixels')
+    parser.add_argument('--output', help='output file (single input only)')
+    parser.add_argument('--suffix', default='_soft', help='appended to the input file name for the output (default _soft)')
+    parser.add_argument('--outdir', help='directory for the outputs (default: next to the inputs)')
+    parser.add_argument('--jobs', type=int, default=1, help='maps processed at once in worker processes (default 1)')
+    parser.add_argument('--threads', type=int, default=1, help='threads for the distance transforms (default 1)')
+    parser.add_argument('--low-memory', action='store_true', help='float32 distance transform limited to extend+width')
+    parser.add_argument('--no-crop', action='store_true', help='process the whole box rather than the mask bounding box')
+    parser.add_argument('--tiled', action='store_true', help='stream the maps from disk in slabs')
+    parser.add_argument('--memory', type=int, default=2048, help='peak memory budget (MB) per job in tiled mode (default 2048)')
+    args = parser.parse_args(argv)
+
+    if args.output is not None and len(args.maps) > 1:
+        parser.error('--output can only be used with a single input map')
+    tasks = []
+    for in_path in args.maps:
+        if args.output is not None:
+            out_path = args.output
+        else:
+            root, ext = os.path.splitext(os.path.basename(in_path))
+            out_dir = args.outdir if args.outdir is not None else os.path.dirname(in_path)
+            out_path = os.path.join(out_dir, root + args.suffix + ext)
+        tasks.append((soft_edge_mask_file, (in_path, out_path, args.level, args.extend, args.width),
+                      dict(angstrom=args.angstrom, low_memory=args.low_memory, crop=not args.no_crop,
+                           threads=args.threads, tiled=args.tiled, memory=args.memory)))
+
+    def progress(i, done, total):
+        print('%d/%d %s -> %s' % (done, total, args.maps[i], tasks[i][1][1]))
+
+    run_tasks(tasks, jobs=args.jobs, progress=progress)
+
+
+MASK_CACHE_BYTES = 2**30 # memory allowed for remembered distance maps per session
+
+
+def cached_mask_distances(session, v, ini_threshold, extend_ini_mask, max_width, low_memory=False, crop=True, threads=1):
+    # mask_distances for a volume, remembered per session and keyed by map, data version, level and extend.
+    # Re-running with a new soft edge width then only needs the cosine. Distances are kept squared in float32
+    # (whole numbers of voxels squared, so the soft mask is unchanged) and entries for closed maps are dropped.
+    from chimerax_cache import session_cache, data_key
+    cache = session_cache(session, 'soft edge mask distances', max_bytes=MASK_CACHE_BYTES)
+    key = data_key(v.data) + (ini_threshold, extend_ini_mask, crop)
+    reach = int(np.ceil(max(max_width, 0)))
+    cached = cache.get(key)
+    if cached is not None and cached[0] >= reach:
+        return cached[1]
+    mask_dist = mask_distances(v.data.matrix(), ini_threshold, extend_ini_mask, max_width,
+                               low_memory=low_memory, crop=crop, threads=threads)
+    if mask_dist is not None and not mask_dist[2]:
+        bounds, distances, squared = mask_dist
+        mask_dist = (bounds, np.rint(np.square(distances)).astype(np.float32), True)
+    return cache.put(key, (reach, mask_dist))[1]
+
+
+def cached_soft_mask(session, v, ini_threshold, extend_ini_mask, width_soft_mask_edge, low_memory=False, crop=True, threads=1):
+    mask_dist = cached_mask_distances(session, v, ini_threshold, extend_ini_mask, width_soft_mask_edge,
+                                      low_memory=low_memory, crop=crop, threads=threads)
+    return soft_mask_from_distances(tuple(v.data.size[::-1]), mask_dist, width_soft_mask_edge)
+
+
+def soft_edge_mask(session, mask, level=0.5, extend=0, width=12, low_memory=False, crop=True, threads=1, jobs=1, tiled=False, memory=2048, output=None, cache=False):
     from chimerax.map_data import ArrayGridData
     from chimerax.map import volume_from_grid_data
-
+    from chimerax.core.commands import run
+    from chimerax.core.errors import UserError
 
     ini_threshold = level
     extend_ini_mask = extend
@@ -60,22 +284,141 @@ def soft_edge_mask(session, mask, level=0.5, extend=0, width=12):
     if width_soft_edge > 0.0:
         session.logger.status("Adding a soft edge (of %.1fpx) to the mask..." % width_soft_edge, log=True)
 
-    if hasattr(mask, '__iter__'): #if list of volumes
-        input_mask_data = mask[0].data
-    else:
-        input_mask_data = mask.data
-    m = input_mask_data.matrix()
-    softmask = extend_and_soften_mask(m, ini_threshold, extend_ini_mask, width_soft_edge)
-    new_mask = ArrayGridData(softmask, origin=input_mask_data.origin, step=input_mask_data.step, cell_angles=input_mask_data.cell_angles, rotation=input_mask_data.rotation, symmetries=input_mask_data.symmetries)
-    v = volume_from_grid_data(new_mask, session)
-    return v
+    maps = list(mask) if hasattr(mask, '__iter__') else [mask] #if list of volumes
+    if tiled and output is not None and len(maps) > 1:
+        raise UserError("The output option can only be used with a single map.")
+
+    # Workers need the functions from an importable module, not from this script's ChimeraX sandbox.
+    import chimerax_soft_edge_mask as kernels
+    from chimerax_parallel import run_tasks
+    log = (lambda msg: session.logger.status(msg)) if jobs <= 1 else print
+    tasks = []
+    for v in maps:
+        input_mask_data = v.data
+        if tiled:
+            in_path = input_mask_data.path
+            if getattr(input_mask_data, 'file_type', None) not in ('mrc', 'ccp4') or not os.path.isfile(in_path):
+                raise UserError("Tiled mode needs a map opened from an MRC file (#%s)." % v.id_string)
+            if output is None:
+                split_path = os.path.splitext(in_path)
+                out_path = split_path[0] + '_soft' + split_path[1]
+            else:
+                out_path = output
+            tasks.append((kernels.soft_edge_mask_tiled, (in_path, out_path, ini_threshold, extend_ini_mask, width_soft_edge),
+                          dict(memory=memory, low_memory=low_memory, crop=crop, threads=threads, log=log)))
+        elif cache and jobs <= 1:
+            tasks.append((cached_soft_mask, (session, v, ini_threshold, extend_ini_mask, width_soft_edge),
+                          dict(low_memory=low_memory, crop=crop, threads=threads)))
+        else:
+            tasks.append((kernels.extend_and_soften_mask, (input_mask_data.matrix(), ini_threshold, extend_ini_mask, width_soft_edge),
+                          dict(low_memory=low_memory, crop=crop, threads=threads)))
+
+    def progress(i, done, total):
+        session.logger.status("Soft edge mask %d of %d done (#%s)" % (done, total, maps[i].id_string), log=True)
+
+    results = run_tasks(tasks, jobs=jobs, progress=progress)
+
+    # Open all the results at the end so the display only updates once
+    new_volumes = []
+    for v, softmask in zip(maps, results):
+        input_mask_data = v.data
+        if tiled:
+            session.logger.status("Soft edge mask written to %s" % softmask, log=True)
+            new_v = run(session, 'open "%s" format mrc' % softmask)[0]
+            new_v.data.set_origin(input_mask_data.origin) # keep any origin set in the session, as the untiled mode does
+            new_v.data.set_step(input_mask_data.step)
+        else:
+            new_mask = ArrayGridData(softmask, origin=input_mask_data.origin, step=input_mask_data.step, cell_angles=input_mask_data.cell_angles, rotation=input_mask_data.rotation, symmetries=input_mask_data.symmetries, name='%s soft' % v.name)
+            new_v = volume_from_grid_data(new_mask, session)
+        new_volumes.append(new_v)
+    return new_volumes[0] if len(new_volumes) == 1 else new_volumes
+
+
+
+def soft_edge_mask_sweep(session, mask, levels=(0.5,), extends=(0.0,), widths=(12.0,), low_memory=False, crop=True, threads=1, save_root=None):
+    # Every combination of level, extend and width. Each distinct (level, extend) distance map is only computed once.
+    from chimerax.map_data import ArrayGridData
+    from chimerax.map import volume_from_grid_data
+    from chimerax.core.commands import run
 
+    maps = list(mask) if hasattr(mask, '__iter__') else [mask]
+    max_width = max(widths)
+    count = len(maps) * len(levels) * len(extends) * len(widths)
+    session.logger.status("Making %d soft edge masks from %d distance maps..." % (count, len(maps) * len(levels) * len(extends)), log=True)
+    for v in maps:
+        data = v.data
+        shape = tuple(data.size[::-1])
+        volumes = []
+        paths = []
+        for level in levels:
+            for extend in extends:
+                mask_dist = cached_mask_distances(session, v, level, extend, max_width,
+                                                  low_memory=low_memory, crop=crop, threads=threads)
+                for width in widths:
+                    softmask = soft_mask_from_distances(shape, mask_dist, width)
+                    name = '%s level %g extend %g width %g' % (v.name, level, extend, width)
+                    if save_root is not None:
+                        root = save_root if len(maps) == 1 else '%s_%s' % (save_root, v.id_string.replace('.', '_'))
+                        path = '%s_level%g_extend%g_width%g.mrc' % (root, level, extend, width)
+                        mrc_io.write_mrc(path, softmask, voxel_size=data.step, origin=data.origin)
+                        paths.append(path)
+                    else:
+                        grid = ArrayGridData(softmask, origin=data.origin, step=data.step, cell_angles=data.cell_angles,
+                                             rotation=data.rotation, symmetries=data.symmetries, name=name)
+                        volumes.append(volume_from_grid_data(grid, session, open_model=False))
+                    session.logger.status("Soft edge mask: %s" % name, log=True)
+        if save_root is not None:
+            session.logger.status("Written %d masks: %s" % (len(paths), ' '.join(paths)), log=True)
+            run(session, 'open %s format mrc vseries true' % ' '.join('"%s"' % p for p in paths))
+        else:
+            session.models.add_group(volumes, name='%s soft edge mask sweep' % v.name)
 
 
 
+def soft_edge_mask_atoms(session, atoms, on_grid=None, spacing=None, radius=3.0, extend=0.0, width=12, threads=1):
+    # Soft edge mask around atoms without going through molmap and a thresholded map.
+    # radius (Angstrom) is added around every atom, then extend and width (pixels) as in soft edge mask.
+    from chimerax.map_data import ArrayGridData
+    from chimerax.map import volume_from_grid_data
+    from chimerax.core.errors import UserError
+    if len(atoms) == 0:
+        raise UserError("Atom specifier selects no atoms")
+    xyz = atoms.scene_coords
+    if on_grid is not None:
+        grid = on_grid[0] if hasattr(on_grid, '__iter__') else on_grid
+        data = grid.data
+        step = np.array(data.step, dtype=float)
+        ijk = data.xyz_to_ijk(grid.scene_position.inverse().transform_points(xyz))
+        shape = tuple(data.size[::-1])
+        origin, cell_angles, rotation, symmetries = data.origin, data.cell_angles, data.rotation, data.symmetries
+        position = grid.scene_position
+    else:
+        if spacing is None:
+            spacing = 1.0
+        step = np.array((spacing, spacing, spacing), dtype=float)
+        pad = radius + (abs(extend) + width + 2) * spacing
+        origin = xyz.min(axis=0) - pad
+        size = np.ceil((xyz.max(axis=0) + pad - origin) / spacing).astype(int) + 1
+        ijk = (xyz - origin) / spacing
+        shape = tuple(size[::-1])
+        cell_angles, rotation, symmetries = (90, 90, 90), ((1, 0, 0), (0, 1, 0), (0, 0, 1)), ()
+        position = None
+    if not np.allclose(step, step[0]):
+        session.logger.warning("Grid spacing is not the same on each axis, using %.3g Angstrom for radius." % step[0])
+    radius_px = max(radius / step[0] + extend, 0)
+    session.logger.status("Soft edge mask of %d atoms (radius %.1fA + %.1fpx, soft edge %.1fpx) on a %d x %d x %d grid..."
+                          % (len(atoms), radius, extend, width, shape[2], shape[1], shape[0]), log=True)
+    softmask = atoms_soft_mask(ijk, shape, radius_px, width, threads=threads)
+    new_mask = ArrayGridData(softmask, origin=origin, step=step, cell_angles=cell_angles, rotation=rotation,
+                             symmetries=symmetries, name='%s soft mask' % atoms.spec)
+    v = volume_from_grid_data(new_mask, session)
+    if position is not None:
+        v.scene_position = position
+    return v
+
 
 def register_command(logger):
-    from chimerax.core.commands import CmdDesc, register, ModelArg, FloatArg, IntArg, StringArg, BoolArg
+    from chimerax.core.commands import CmdDesc, register, ModelArg, FloatArg, FloatsArg, IntArg, StringArg, BoolArg, SaveFileNameArg
     from chimerax.map import MapsArg
     from chimerax.atomic import AtomsArg
     from chimerax.map import molmap
@@ -86,10 +429,46 @@ def register_command(logger):
         required=[('mask', MapsArg)],
         keyword=[('extend', FloatArg),
                 ('level', FloatArg),
-                ('width', FloatArg)],
+                ('width', FloatArg),
+                ('low_memory', BoolArg), #Default False. Float32 distance transform limited to extend+width (less memory).
+                ('crop', BoolArg), #Default True. Only process the bounding box of the mask padded by extend+width.
+                ('threads', IntArg), #Default 1. Threads for the distance transforms.
+                ('jobs', IntArg), #Default 1. Number of maps processed at once in worker processes.
+                ('tiled', BoolArg), #Default False. Stream the MRC file in slabs instead of loading the whole map.
+                ('memory', IntArg), #Peak memory budget (MB) for tiled mode. Default 2048.
+                ('output', SaveFileNameArg), #Output MRC file for tiled mode. Defaults to <input>_soft.mrc
+                ('cache', BoolArg)], #Default False. Keep the distance map so another width on the same map only needs the cosine.
         required_arguments=['mask'],
         synopsis='Binaraize a map, extend it and apply a raised cosine soft edge.')
     register('soft edge mask', desc, soft_edge_mask, logger=logger)
 
+    desc = CmdDesc(
+        required=[('mask', MapsArg)],
+        keyword=[('levels', FloatsArg), #Comma separated lists of values to try, e.g. levels 0.4,0.5
+                ('extends', FloatsArg),
+                ('widths', FloatsArg),
+                ('low_memory', BoolArg),
+                ('crop', BoolArg),
+                ('threads', IntArg),
+                ('save_root', SaveFileNameArg)], #Save as <save_root>_level<l>_extend<e>_width<w>.mrc and open as a series
+        required_arguments=['mask'],
+        synopsis='Soft edge masks for every combination of levels, extends and widths.')
+    register('soft edge mask sweep', desc, soft_edge_mask_sweep, logger=logger)
+
+    desc = CmdDesc(
+        required=[('atoms', AtomsArg)],
+        keyword=[('on_grid', MapsArg), #Use the grid of this map. Otherwise a new grid around the atoms.
+                ('spacing', FloatArg), #Angstrom per pixel for a new grid. Default 1.
+                ('radius', FloatArg), #Angstrom around each atom. Default 3.
+                ('extend', FloatArg), #Pixels
+                ('width', FloatArg), #Pixels
+                ('threads', IntArg)],
+        required_arguments=['atoms'],
+        synopsis='Soft edge mask directly from atomic coordinates.')
+    register('soft edge mask atoms', desc, soft_edge_mask_atoms, logger=logger)
+
 
-register_command(session.logger)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
+elif 'session' in globals(): # opened as a ChimeraX script (not imported as a module by worker processes)
+    register_command(session.logger)
\ No newline at end of file
@@ -3,33 +3,7 @@
 
 import os
 import numpy as np
-
-
-
-def define_centroid(session, atoms, mass_weighting=False): # from cmd_centroid
-    from chimerax.core.errors import UserError
-    from chimerax.centroids import centroid
-    from chimerax.atomic import AtomicStructure, concatenate
-    if atoms is None:
-        structures_atoms = [m.atoms for m in session.models if isinstance(m, AtomicStructure)]
-        if structures_atoms:
-            atoms = concatenate(structures_atoms)
-    if not atoms:
-        raise UserError("Atom specifier selects no atoms")
-    structures = atoms.unique_structures
-    if len(structures) > 1:
-        crds = atoms.scene_coords
-    else:
-        crds = atoms.scene_coords #was atoms.coords ?
-    if mass_weighting:
-        masses = atoms.elements.masses
-        avg_mass = masses.sum() / len(masses)
-        import numpy
-        weights = masses[:, numpy.newaxis] / avg_mass
-    else:
-        weights = None
-    xyz = centroid(crds, weights=weights)
-    return xyz
+from chimerax_centroids import define_centroid
 
 
 def go_to_residue(session, to, to_ends=False, first=True, NoMove=False):